@@ -0,0 +1,63 @@
+"""
+Measures how the nearest neighbors classifiers scale with the size of the training set,
+for each search algorithm (see KNN_ALGORITHM in src/build_models.py): the time to fit,
+the time to classify a single region and a batch of regions, and the size of the model.
+
+    $ python benchmarks/knn.py [--sizes 1000,10000,100000] [--k 1,3,5] [--runs 5]
+
+The training sets are synthetic: standardized features, with as many dimensions as
+the real ones, drawn around a few class centers in a low dimensional subspace (the real
+features are strongly correlated with each other).
+"""
+import pickle
+import statistics
+import sys
+import time
+
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+"""Number of features of a region (see features.get_labels)"""
+DIMENSIONS = 47
+ALGORITHMS = ['brute', 'kd_tree', 'ball_tree']
+
+def synthetic(n, dimensions=DIMENSIONS, classes=10, rank=8, seed=0):
+    """
+    Returns n standardized feature vectors and their classes.
+    """
+    rng = np.random.RandomState(seed)
+    basis = rng.standard_normal((rank, dimensions))
+    centers = 3 * rng.standard_normal((classes, rank))
+    y = rng.randint(classes, size=n)
+    X = (centers[y] + rng.standard_normal((n, rank))) @ basis + 0.3 * rng.standard_normal((n, dimensions))
+    return (X - X.mean(axis=0)) / X.std(axis=0), y.astype(str)
+
+def median_time(f, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    sizes = [int(s) for s in sys.argv[sys.argv.index('--sizes') + 1].split(',')] if '--sizes' in sys.argv else [1000, 10000, 100000]
+    ks = [int(k) for k in sys.argv[sys.argv.index('--k') + 1].split(',')] if '--k' in sys.argv else [1, 3, 5]
+    runs = int(sys.argv[sys.argv.index('--runs') + 1]) if '--runs' in sys.argv else 5
+
+    print('%8s %-10s %3s %10s %12s %14s %10s' % ('size', 'algorithm', 'k', 'fit ms', 'query ms', 'per ROI ms', 'size KB'))
+    for n in sizes:
+        X, y = synthetic(n)
+        queries, _ = synthetic(100, seed=1)
+        for algorithm in ALGORITHMS:
+            for k in ks:
+                clf = KNeighborsClassifier(k, algorithm=algorithm)
+                fit = median_time(lambda: clf.fit(X, y), 1)
+                clf.predict(queries[:1])
+                one = median_time(lambda: clf.predict(queries[:1]), runs)
+                batch = median_time(lambda: clf.predict(queries), runs)
+                print('%8d %-10s %3d %10.1f %12.3f %14.4f %10.0f' % (n, algorithm, k, 1000 * fit, 1000 * one,
+                      1000 * batch / len(queries), len(pickle.dumps(clf, protocol=4)) / 1024))
+
+if __name__ == '__main__':
+    main()
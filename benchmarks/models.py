@@ -0,0 +1,101 @@
+"""
+Measures, for every model in models/ (or in --root), how long it takes to load, how much
+memory it takes once loaded, and how long it takes to predict, both when read into memory
+and when memory-mapped (as the model registry loads them):
+
+    $ python benchmarks/models.py [--root models] [--runs 5] [--rows 100]
+
+Each measurement runs in a fresh interpreter, so models are not shared between them.
+"""
+import glob
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def memory():
+    """
+    Returns the resident memory of this process, and the part of it which is anonymous
+    (i.e. not backed by files, which memory-mapped files are, so it can't be shared
+    with other processes), in bytes. The anonymous memory is only available on Linux
+    (None elsewhere).
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line and not line.startswith(' '))
+        kb = lambda name: int(fields[name].split()[0]) * 1024
+        return kb('Rss'), kb('Anonymous')
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak * (1 if sys.platform == 'darwin' else 1024), None
+
+def measure(path, mmap, runs, rows):
+    """
+    Loads a model and predicts with it (in this process), and prints the results as JSON.
+    """
+    import numpy as np
+    from joblib import load
+    # The modules of every classifier (see build_models), so importing them is not measured
+    for module in ('sklearn.ensemble', 'sklearn.naive_bayes', 'sklearn.neighbors', 'sklearn.pipeline',
+                   'sklearn.preprocessing', 'sklearn.svm', 'sklearn.tree'):
+        importlib.import_module(module)
+
+    rss, anonymous = memory()
+    start = time.perf_counter()
+    clf = load(path, mmap_mode='r' if mmap else None)
+    loaded = time.perf_counter() - start
+
+    # Random features, with the distribution the scaler was fitted on
+    scaler = clf.steps[0][1]
+    rng = np.random.RandomState(0)
+    X = scaler.mean_ + scaler.scale_ * rng.standard_normal((rows, len(scaler.mean_)))
+
+    clf.predict(X[:1]) # so first-call costs are not measured
+    single, batch = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        clf.predict(X[:1])
+        single.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        clf.predict(X)
+        batch.append(time.perf_counter() - start)
+
+    rss_after, anonymous_after = memory()
+    print(json.dumps({
+        'load_seconds': loaded,
+        'rss_bytes': rss_after - rss,
+        'anonymous_bytes': None if anonymous is None else anonymous_after - anonymous,
+        'predict_one_seconds': statistics.median(single),
+        'predict_per_roi_seconds': statistics.median(batch) / rows
+    }))
+
+def main():
+    if '--measure' in sys.argv:
+        i = sys.argv.index('--measure')
+        return measure(sys.argv[i + 1], sys.argv[i + 2] == 'mmap', int(sys.argv[i + 3]), int(sys.argv[i + 4]))
+
+    root = sys.argv[sys.argv.index('--root') + 1] if '--root' in sys.argv else os.path.join(ROOT, 'models')
+    runs = int(sys.argv[sys.argv.index('--runs') + 1]) if '--runs' in sys.argv else 5
+    rows = int(sys.argv[sys.argv.index('--rows') + 1]) if '--rows' in sys.argv else 100
+
+    print('%-30s %-6s %9s %10s %9s %9s %11s %13s' % ('model', 'load', 'size KB', 'load ms', 'RSS KB',
+                                                      'anon. KB', 'predict ms', 'per ROI ms'))
+    for path in sorted(glob.glob(os.path.join(root, '*', '*.joblib'))):
+        name = os.path.relpath(path, root)
+        for mode in ('read', 'mmap'):
+            output = subprocess.run([sys.executable, __file__, '--measure', path, mode, str(runs), str(rows)],
+                                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print('%-30s %-6s %9.1f %10.2f %9.0f %9s %11.3f %13.4f' % (name, mode, os.path.getsize(path) / 1024,
+                  1000 * r['load_seconds'], r['rss_bytes'] / 1024,
+                  '-' if r['anonymous_bytes'] is None else '%.0f' % (r['anonymous_bytes'] / 1024),
+                  1000 * r['predict_one_seconds'], 1000 * r['predict_per_roi_seconds']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Times every stage of the segmentation and feature extraction pipeline on a fixed corpus
+of images: synthetic images generated here, plus any local images given with --images.
+Each stage's time is the median, over several runs, of its total time over the corpus.
+
+    $ python benchmarks/pipeline.py [--runs 3] [--images DIRECTORY] [--models-root models]
+                                    [--output results.json]
+                                    [--baseline baseline.json] [--threshold 0.25]
+
+The results are written as JSON (--output). Given the results of a previous run
+(--baseline), every stage slower than it by more than the threshold (a fraction) is
+reported, and the script fails (exit code 1).
+"""
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'src', 'libs')]
+
+import cv2
+import mahotas
+import numpy as np
+
+import classify
+import features
+import keypoints
+import preprocessor
+import shape_features
+import subimages
+from extraction_cache import cache
+from model_registry import registry
+
+"""Version of the results format"""
+VERSION = 1
+
+"""The synthetic images of the corpus, as (seed, height, width, number of objects)"""
+SYNTHETIC = [(0, 600, 800, 4), (1, 1200, 1600, 6), (2, 1200, 1600, 10)]
+
+PREPROCESSORS = ['otsu', 'otsu_triangles', 'canny', 'sprinkles', 'project', 'new_process', 'new_process_2', 'stacked']
+
+"""Stages faster than this (in seconds) are not checked for regressions, as they are mostly noise"""
+MIN_SECONDS = 0.005
+
+def synthetic_image(seed, height, width, objects):
+    """
+    Draws a grayscale image resembling a microscope image: a noisy bright background
+    with dark, textured, elongated objects.
+    """
+    rng = np.random.RandomState(seed)
+    img = (np.full((height, width), 215.0) + rng.normal(0, 6, (height, width))).clip(0, 255).astype(np.uint8)
+    for _ in range(objects):
+        cx, cy = rng.randint(200, width - 200), rng.randint(200, height - 200)
+        ax, ay = rng.randint(40, 150), rng.randint(20, 80)
+        cv2.ellipse(img, (cx, cy), (ax, ay), rng.randint(0, 180), 0, 360, int(rng.randint(30, 90)), -1)
+        for _ in range(12):
+            cv2.circle(img, (cx + rng.randint(-ax, ax), cy + rng.randint(-ay, ay)), rng.randint(3, 12), int(rng.randint(120, 250)), -1)
+        cv2.line(img, (cx, cy), (cx + rng.randint(-200, 200), cy + rng.randint(-200, 200)), 40, 4)
+    return img
+
+def corpus(directory=None):
+    """
+    Returns the images to be benchmarked, as a list of (name, grayscale image).
+    """
+    images = [('synthetic-%d-%dx%d' % (seed, w, h), synthetic_image(seed, h, w, n)) for (seed, h, w, n) in SYNTHETIC]
+    if directory:
+        for f in sorted(glob.glob(os.path.join(directory, '**', '*'), recursive=True)):
+            if f[-3:].lower() in ['jpg', 'png', 'tif', 'bmp']:
+                images.append((os.path.relpath(f, directory), cv2.imread(f, cv2.IMREAD_GRAYSCALE)))
+    return images
+
+def stages(images, models):
+    """
+    Returns the stages to be timed, by name. Each one is a function of no arguments
+    which runs the stage on every image (or region of interest) of the corpus.
+    """
+    rois = [(img, cropped, cnt) for (_, img) in images for (cropped, cnt) in subimages.extract(img, preprocessor.default_ensemble)]
+    contexts = [keypoints.KeypointContext(img) for (_, img) in images]
+    context_of = {id(img): c for ((_, img), c) in zip(images, contexts)}
+
+    def for_images(f):
+        return lambda: [f(img) for (_, img) in images]
+    def for_cropped_rois(f):
+        return lambda: [f(cropped, img, cnt) for (img, cropped, cnt) in rois]
+
+    result = {'preprocessor.%s' % name: for_images(getattr(preprocessor, name)) for name in PREPROCESSORS}
+    result.update({
+        'preprocessor.default_ensemble': for_images(preprocessor.default_ensemble),
+        'keypoints.KeypointContext': for_images(keypoints.KeypointContext),
+        'subimages.extract': for_images(lambda img: subimages.extract(img, preprocessor.default_ensemble, context_of[id(img)])),
+        'features.orb_features': for_cropped_rois(lambda cropped, img, cnt: features.orb_features(cropped, img, cnt, context=context_of[id(img)])),
+        'features.get': for_cropped_rois(lambda cropped, img, cnt: features.get(cropped, img, cnt, context=context_of[id(img)])),
+        # As features.get calls them, on the cropped image
+        'shape_features.get': for_cropped_rois(lambda cropped, img, cnt: shape_features.get(cropped, cnt)),
+        'shape_features.get_rect_features': for_cropped_rois(lambda cropped, img, cnt: shape_features.get_rect_features(cropped, cnt)),
+        'shape_features.get_el_mean': for_cropped_rois(lambda cropped, img, cnt: shape_features.get_el_mean(cropped, cnt)),
+        'shape_features.hu_moments': for_cropped_rois(lambda cropped, img, cnt: cv2.HuMoments(cv2.moments(cropped))),
+        'shape_features.haralick': for_cropped_rois(lambda cropped, img, cnt: mahotas.features.haralick(cropped)),
+        'classify.extract': for_images(classify.extract),
+    })
+    colored = [cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) for (_, img) in images]
+    for (classes, model) in models:
+        result['classify.classify[%s/%s]' % (classes, model)] = (lambda c, m: lambda: [classify.classify(img, c, m) for img in colored])(classes, model)
+    return result, len(rois)
+
+def loadable_models():
+    """
+    Returns the (classes, model) pairs which can be loaded, e.g. not trained with
+    another version of scikit-learn, loading them.
+    """
+    models = []
+    for classes in ('general', 'specific'):
+        for model in registry.available(classes):
+            try:
+                registry.get(classes, model)
+                models.append((classes, model))
+            except Exception as e:
+                print('Skipping %s/%s, which could not be loaded: %s' % (classes, model, e), file=sys.stderr)
+    return models
+
+def run(images, runs, models):
+    """
+    Times every stage (see "stages") runs times.
+
+    Returns
+    -------
+    results : dict
+        The JSON serializable results: the environment, the corpus and, for each stage,
+        the median and every run's time, in seconds.
+    """
+    cache.max_bytes = 0 # classify.classify must not reuse the features of previous runs
+    timed, roi_count = stages(images, models)
+
+    results = {}
+    for name, stage in timed.items():
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            stage()
+            times.append(time.perf_counter() - start)
+        results[name] = {'seconds': statistics.median(times), 'runs': times}
+        print('%-45s %9.3fs' % (name, results[name]['seconds']))
+
+    return {
+        'version': VERSION,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'corpus': {'images': [{'name': name, 'shape': list(img.shape)} for (name, img) in images], 'rois': roi_count},
+        'stages': results
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Prints how much each stage changed from the baseline.
+
+    Returns
+    -------
+    regressions : list of strings
+        The stages slower than the baseline by more than threshold (a fraction).
+    """
+    if results['corpus'] != baseline['corpus']:
+        print('Warning: the corpus differs from the baseline, so timings may not be comparable')
+
+    regressions = []
+    print('%-45s %10s %10s %8s' % ('stage', 'baseline', 'current', 'change'))
+    for name, stage in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        old, new = baseline['stages'][name]['seconds'], stage['seconds']
+        change = new / old - 1 if old > 0 else 0
+        regressed = change > threshold and new - old > MIN_SECONDS
+        if regressed:
+            regressions.append(name)
+        print('%-45s %9.3fs %9.3fs %+7.1f%%%s' % (name, old, new, 100 * change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+def main():
+    option = lambda name, default, type=str: type(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+    runs = option('--runs', 3, int)
+    output = option('--output', None)
+    baseline = option('--baseline', None)
+    threshold = option('--threshold', 0.25, float)
+    registry.root = option('--models-root', registry.root)
+
+    results = run(corpus(option('--images', None)), runs, loadable_models())
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), threshold)
+        if regressions:
+            print('%d stage(s) slower than the baseline by more than %d%%: %s' % (len(regressions), 100 * threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures how long Planktool takes to start, by running each command below in a fresh
+interpreter several times and taking the median wall time. Commands are run through
+planktool.py with --help, which is answered once the command's modules are imported,
+so everything a command loads before doing any work is measured.
+
+Fails (exit code 1) if the startup of `planktool.py classify` exceeds its budget:
+
+    $ python benchmarks/startup.py [--runs 5] [--budget 1.0]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+"""Seconds that `planktool.py classify` may take before doing any work"""
+BUDGET = 1.0
+
+COMMANDS = {
+    # Parses the command line and dispatches, without importing any command
+    'planktool.py': ['none'],
+    'planktool.py classify': ['classify', '--help'],
+    'planktool.py build-dataset': ['build-dataset', '--help'],
+    'planktool.py build-models': ['build-models', '--help'],
+    'planktool.py evaluate': ['evaluate', '--help'],
+    'planktool.py serve': ['serve', '--help'],
+}
+
+def measure(arguments, runs):
+    """
+    Returns the median wall time, in seconds, of running planktool.py with the given arguments.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'planktool.py')] + arguments, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    runs = int(sys.argv[sys.argv.index('--runs') + 1]) if '--runs' in sys.argv else 5
+    budget = float(sys.argv[sys.argv.index('--budget') + 1]) if '--budget' in sys.argv else BUDGET
+
+    results = {name: measure(command, runs) for name, command in COMMANDS.items()}
+    for name, seconds in results.items():
+        print('%-30s %7.3fs' % (name, seconds))
+
+    if results['planktool.py classify'] > budget:
+        print('planktool.py classify startup exceeds its budget of %.2fs' % budget)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,119 @@
 import sys
 import os
 
-sys.path.append('./src')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './src'))
 
-import build_dataset
-import build_models
 import subprocess
 
-if len(sys.argv) <= 1:
-    print('No command passed!')
-    exit
-command = sys.argv[1]
-
 def get_path(p):
     return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), p))
 
-if command == 'build-dataset':
-    build_dataset.build_dataset()
-elif command == 'build-models':
-    build_models.build_models()
-elif command == 'build':
-    build_dataset.build_dataset()
-    build_models.build_models()
-elif command == 'web':
-    p = get_path('./src/ui/web')
-    subprocess.call("cd %s & flask run" % p, shell=True)
-elif command == 'gui':
-    p = get_path('./src/ui/gui/main.py')
-    subprocess.call("python " + p, shell=True)
-else:
-    print('Unrecognized command.')
\ No newline at end of file
+def get_option(name, default, type=str):
+    """Returns the value following `name` in the command line (e.g. `--workers 4`), or default."""
+    if name in sys.argv[2:-1]:
+        return type(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+def has_flag(name):
+    """Returns whether `name` was passed in the command line (e.g. `--rebuild`)."""
+    return name in sys.argv[2:]
+
+USAGE = {
+    'build-dataset': 'build-dataset [--workers N] [--chunksize N] [--rebuild] [--no-csv]',
+    'build-models': 'build-models [--workers N] [--knn-algorithm brute|kd_tree|ball_tree]',
+    'build': 'build [--workers N] [--chunksize N] [--rebuild] [--no-csv] [--knn-algorithm brute|kd_tree|ball_tree]',
+    'evaluate': 'evaluate [--classes general|specific] [--models random_forest,svm] [--folds N] [--workers N] '
+                '[--no-balance] [--min-accuracy X] [--output report.csv]',
+    'classify': 'classify <directory|glob> [--output results.csv|results.jsonl] [--classes general] '
+                '[--model random_forest] [--proba] [--annotate DIRECTORY] [--workers N] [--chunksize N] [--tile-size N]',
+    'serve': 'serve [--host 0.0.0.0] [--port 5000] [--workers N] [--threads N] [--max-concurrent N] [--max-upload-mb X] '
+             '[--no-preload] [--job-workers N] [--max-jobs N] [--cache-mb X] [--cache-dir DIRECTORY] [--jobs-dir DIRECTORY]',
+}
+
+def usage(command):
+    print('Usage: planktool.py ' + USAGE[command])
+
+def main():
+    if len(sys.argv) <= 1:
+        print('No command passed!')
+        return
+    command = sys.argv[1]
+
+    workers = get_option('--workers', 1, int)
+    chunksize = get_option('--chunksize', 1, int)
+    use_cache = not has_flag('--rebuild')
+    csv = not has_flag('--no-csv')
+
+    # Modules are only imported by the commands that need them, as some of them are slow to import.
+    # `--help` is answered once they are imported, so it goes through the command's startup
+    if command == 'build-dataset':
+        import build_dataset
+        if has_flag('--help'):
+            return usage(command)
+        build_dataset.build_dataset(workers, chunksize, use_cache, csv)
+    elif command == 'build-models':
+        import build_models
+        if has_flag('--help'):
+            return usage(command)
+        build_models.build_models(workers, get_option('--knn-algorithm', build_models.KNN_ALGORITHM))
+    elif command == 'build':
+        import build_dataset
+        import build_models
+        if has_flag('--help'):
+            return usage(command)
+        build_dataset.build_dataset(workers, chunksize, use_cache, csv)
+        build_models.build_models(workers, get_option('--knn-algorithm', build_models.KNN_ALGORITHM))
+    elif command == 'evaluate':
+        import evaluate
+        if has_flag('--help'):
+            return usage(command)
+        classes = get_option('--classes', None)
+        models = get_option('--models', None)
+        evaluate.run(classes=[classes] if classes else ['general', 'specific'],
+            models=models.split(',') if models else None,
+            folds=get_option('--folds', 5, int),
+            workers=workers,
+            balance=not has_flag('--no-balance'),
+            min_accuracy=get_option('--min-accuracy', None, float),
+            output=get_option('--output', None))
+    elif command == 'classify':
+        import batch_classify
+        if len(sys.argv) <= 2 or sys.argv[2].startswith('--'):
+            return usage(command)
+        batch_classify.batch_classify(sys.argv[2],
+            output=get_option('--output', 'results.csv'),
+            classes=get_option('--classes', 'general'),
+            model=get_option('--model', 'random_forest'),
+            proba=has_flag('--proba'),
+            annotate=get_option('--annotate', None),
+            workers=workers, chunksize=chunksize,
+            tile_size=get_option('--tile-size', None, int))
+    elif command == 'serve':
+        sys.path.append(get_path('./src/ui/web'))
+        import serve
+        if has_flag('--help'):
+            return usage(command)
+        serve.serve(host=get_option('--host', '0.0.0.0'),
+            port=get_option('--port', 5000, int),
+            workers=get_option('--workers', 2, int),
+            threads=get_option('--threads', 4, int),
+            max_concurrent=get_option('--max-concurrent', None, int),
+            max_upload_mb=get_option('--max-upload-mb', 32, float),
+            preload=not has_flag('--no-preload'),
+            job_workers=get_option('--job-workers', 1, int),
+            max_jobs=get_option('--max-jobs', 16, int),
+            cache_mb=get_option('--cache-mb', 64, float),
+            cache_dir=get_option('--cache-dir', None),
+            jobs_dir=get_option('--jobs-dir', None))
+    elif command == 'web':
+        p = get_path('./src/ui/web')
+        subprocess.call("cd %s & flask run" % p, shell=True)
+    elif command == 'gui':
+        p = get_path('./src/ui/gui/main.py')
+        subprocess.call("python " + p, shell=True)
+    else:
+        print('Unrecognized command.')
+
+# Worker processes (e.g. `build-dataset --workers 4` on Windows) import this file again
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Classifies every image of a directory (or matching a glob pattern) without any user
+interface, writing the detected regions of interest to a csv or jsonl file.
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './libs'))
+
+import csv
+import functools
+import glob
+import json
+import multiprocessing
+
+import cv2
+
+import classify
+import utilities as utils
+from model_registry import registry
+
+FILETYPES = ['jpg', 'png', 'tif', 'bmp']
+COLUMNS = ['filename', 'roi', 'x', 'y', 'w', 'h', 'class', 'probability']
+
+def list_images(source):
+    """
+    Lists the images to be classified.
+
+    Parameters
+    ----------
+    source : string
+        A directory (searched recursively) or a glob pattern.
+
+    Returns
+    -------
+    root : string
+        The directory the images are relative to.
+
+    files : list of strings
+    """
+    if os.path.isdir(source):
+        return source, sorted(utils.find_files(source, filetypes=FILETYPES))
+    files = sorted(f for f in glob.glob(source, recursive=True) if f[-3:].lower() in FILETYPES)
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files]) if files else '.'
+    return root, files
+
+def process_image(f, root, classes, model, proba, annotate, tile_size=None):
+    """
+    Classifies a single image. Images are independent of each other, so this is the
+    unit of work of the worker processes.
+
+    Parameters
+    ----------
+    f : string
+        Path of the image.
+
+    root : string
+        The directory the image path is relative to, used to place the annotated image.
+
+    classes, model : string
+        The model to be used (see classify.detect).
+
+    proba : bool
+        Whether probabilities should be computed.
+
+    annotate : string
+        Directory where the annotated image is written. None means no annotated images.
+
+    tile_size : int
+        Images larger than this are segmented in tiles (see classify.extract).
+
+    Returns
+    -------
+    rows : list of lists
+        One row per region of interest, with the values of COLUMNS.
+
+    error : string
+        Why the image could not be classified (e.g. it is not a readable image), or
+        None. Errors are returned instead of raised, so a single bad image does not
+        stop the whole batch.
+    """
+    try:
+        img = cv2.imread(f)
+        if img is None:
+            raise ValueError('not a readable image')
+        detections = classify.detect(img, classes, model, proba, tile_size)
+        if annotate:
+            path = os.path.join(annotate, os.path.relpath(os.path.abspath(f), os.path.abspath(root)))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            cv2.imwrite(path, classify.render(img, detections, classify.class_list(classes, model)))
+    except Exception as e:
+        return [], '%s: %s' % (type(e).__name__, e)
+    return [[os.path.normpath(f), i] + list(d['box']) + [d['class'], d['probability']] for i, d in enumerate(detections)], None
+
+def batch_classify(source, output='results.csv', classes='general', model='random_forest',
+                   proba=False, annotate=None, workers=1, chunksize=1, tile_size=None):
+    """
+    Classifies many images, and writes one line per region of interest to output.
+
+    Parameters
+    ----------
+    source : string
+        A directory (searched recursively) or a glob pattern.
+
+    output : string
+        The results file. Its format is chosen by its extension: .csv or .jsonl.
+
+    classes : string
+        The set of classes ('general' or 'specific').
+
+    model : string
+        The model name, e.g. 'random_forest'.
+
+    proba : bool
+        Whether the probability of each prediction should be computed.
+
+    annotate : string
+        Directory where annotated images are written, keeping the directory structure
+        of source. None means no annotated images.
+
+    workers : int
+        Number of processes classifying images. 1 classifies them in this process,
+        and 0 uses one process per CPU.
+
+    chunksize : int
+        How many images are sent to a worker process at a time.
+
+    tile_size : int
+        Images larger than this (in width or height) are segmented in overlapping tiles
+        of this size, which bounds the memory used by each worker. None segments every
+        image at once.
+
+    Returns
+    -------
+    failed : list of tuples (filename, error)
+        The images which could not be classified. They are reported and skipped.
+    """
+    jsonl = output.lower().endswith('.jsonl')
+    root, files = list_images(source)
+    registry.get(classes, model) # a model which can't be loaded fails the batch, not every image
+
+    process = functools.partial(process_image, root=root, classes=classes, model=model, proba=proba, annotate=annotate, tile_size=tile_size)
+    workers = workers or os.cpu_count()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    results = pool.imap(process, files, chunksize) if pool else map(process, files)
+
+    progress = utils.Throughput(len(files))
+    failed = []
+    try:
+        with open(output, 'w', newline='') as out:
+            writer = None if jsonl else csv.writer(out)
+            if writer:
+                writer.writerow(COLUMNS)
+            for f, (rows, error) in zip(files, results):
+                if error:
+                    print('Skipping %s: %s' % (f, error), file=sys.stderr)
+                    failed.append((f, error))
+                for row in rows:
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        out.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
+                progress.update(len(rows))
+    finally:
+        if pool:
+            pool.terminate()
+    if failed:
+        print('%d of %d images could not be classified' % (len(failed), len(files)), file=sys.stderr)
+    return failed
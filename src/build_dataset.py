@@ -1,6 +1,6 @@
 """
 Computes the features of each region of interest (subimage) in each of the images of INPUT
-and produces a csv file.
+and produces a dataset, in the columnar format and as a csv file.
 """
 import sys
 import os
@@ -9,48 +9,193 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './libs
 
 import subimages
 import features
+import keypoints
 import os
-import pandas as pd
+import functools
+import hashlib
+import json
+import multiprocessing
 import utilities as utils
 import preprocessor
+import dataset
 
 import cv2
 
 INPUT = '../input_images'
 OUTPUT = './'
+CACHE = os.path.join(OUTPUT, 'feature_cache')
 
-def build_dataset():
+def list_images():
+    """
+    Lists the images of INPUT, directory by directory, in the order they are processed.
+
+    Returns
+    -------
+    files : list of strings
+    """
     directories = [x[0] for x in os.walk(INPUT)]
     directories.reverse()
 
-    #Clear existing
-    existing_csv = utils.find_files(OUTPUT, filetypes=['csv'])
-    for csv in existing_csv:
-        os.remove(csv)
+    files = []
+    for d in directories:
+        files += utils.find_files(d, depth=0) #all jpegs within d
+    return files
+
+def cache_key(f):
+    """
+    Returns the key of an image in the feature cache: a hash of its contents and of
+    the feature extraction version. Renamed or moved images keep their key.
 
-    matrix = []
+    Parameters
+    ----------
+    f : string
+        Path of the image.
+
+    Returns
+    -------
+    key : string
+    """
+    h = hashlib.sha1(b'features-v%d:' % features.VERSION)
+    with open(f, 'rb') as image_file:
+        for block in iter(lambda: image_file.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def extract(f):
+    """
+    Computes the features and bounding rectangles of the regions of interest of an image.
+
+    Parameters
+    ----------
+    f : string
+        Path of the image.
+
+    Returns
+    -------
+    extracted : list of tuples (features, bounding rectangle)
+    """
+    full_image = utils.image_read(f)
+    context = keypoints.KeypointContext(full_image)
+    rois = subimages.extract(full_image, preprocessor.default_ensemble, context)
+    extracted = []
+    for (cropped, cnt) in rois:
+        vector = features.get(cropped, full_image, cnt, context=context)
+        if(vector is False):
+            continue #skip it
+        extracted.append((vector, list(cv2.boundingRect(cnt))))
+    return extracted
+
+def _cache_path(key):
+    return os.path.join(CACHE, key + '.json')
+
+def _cache_load(key):
+    try:
+        with open(_cache_path(key)) as cached:
+            return [tuple(e) for e in json.load(cached)]
+    except (IOError, ValueError):
+        return None
+
+def _cache_store(key, extracted):
+    # Written to a temporary file first, so an interrupted build never leaves a partial entry
+    tmp = _cache_path(key) + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as cached:
+        json.dump(extracted, cached, default=lambda v: v.item())
+    os.replace(tmp, _cache_path(key))
+
+def process_image(f, use_cache=True):
+    """
+    Computes the rows of the dataset for a single image, one for each of its regions of interest.
+    Images are independent of each other, so this is the unit of work of the parallel mode.
+
+    Features are kept in the feature cache, so unchanged images are not processed again.
+
+    Parameters
+    ----------
+    f : string
+        Path of the image.
+
+    use_cache : bool
+        Whether cached features may be used (they are stored either way).
+
+    Returns
+    -------
+    key : string
+        The key of the image in the feature cache.
+
+    rows : list of lists
+    """
+    key = cache_key(f)
+    extracted = _cache_load(key) if use_cache else None
+    if extracted is None:
+        extracted = extract(f)
+        _cache_store(key, extracted)
+
+    specific = os.path.basename(os.path.dirname(f))
+    general = os.path.dirname(f).split(os.sep)[1]
+    filename = os.path.normpath(f) #"%s_%d" % ( os.path.basename(f), i )
+    rows = [list(vector) + [specific, general, filename] + list(rect) for (vector, rect) in extracted]
+    return key, rows
+
+def build_dataset(workers=1, chunksize=1, use_cache=True, csv=True):
+    """
+    Builds the dataset.
+
+    The features of each image are cached in CACHE, keyed by the image contents and
+    the feature extraction version. Rebuilding only processes new or modified images,
+    and cache entries of images that are gone are removed.
+
+    Rows are streamed to disk in batches as images are processed (see dataset.Writer).
+    If the build is interrupted, the previous dataset is kept, and running it again
+    resumes from the last completed image, as those are already cached.
+
+    Parameters
+    ----------
+    workers : int
+        Number of processes extracting features. 1 processes the images in this
+        process, and 0 uses one process per CPU.
+
+    chunksize : int
+        How many images are sent to a worker process at a time.
+
+    use_cache : bool
+        If False, features of every image are computed again.
+
+    csv : bool
+        Whether dataset.csv is written as well as the columnar dataset (see dataset.write_columnar).
+    """
+    if not os.path.isdir(CACHE):
+        os.makedirs(CACHE)
+
+    files = list_images()
+    process = functools.partial(process_image, use_cache=use_cache)
+    workers = workers or os.cpu_count()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    # Results come back in the same order as files, so the dataset is the same as in serial mode
+    results = pool.imap(process, files, chunksize) if pool else map(process, files)
 
-    for d in directories:
-        print ("Getting features for %s" % d)
-
-        files = utils.find_files(d, depth=0) #all jpegs within d
-
-        for f in files:
-            full_image = utils.image_read(f)
-            rois = subimages.extract(full_image, preprocessor.default_ensemble)
-            i = 0
-            for (cropped, cnt) in rois:
-                vector = features.get(full_image, cropped, cnt)
-                if(vector is False):
-                    continue #skip it
-                specific = os.path.basename(os.path.dirname(f))
-                general = os.path.dirname(f).split(os.sep)[1]
-                filename = os.path.normpath(f) #"%s_%d" % ( os.path.basename(f), i )
-                vector += [specific, general, filename] + list(cv2.boundingRect(cnt))
-                matrix.append(vector)
-                
-                i += 1
     cols = features.get_labels() + ['specific_class', 'general_class', 'filename', 'x', 'y', 'w', 'h']
-    df = pd.DataFrame(matrix, columns=cols)
+    writer = dataset.Writer(os.path.join(OUTPUT, 'dataset'), cols, ['specific_class', 'general_class', 'filename'], csv)
+    keys = set()
+    progress = utils.Throughput(len(files))
+    directory = None
+    try:
+        for f, (key, rows) in zip(files, results):
+            if os.path.dirname(f) != directory:
+                directory = os.path.dirname(f)
+                print ("Getting features for %s" % directory)
+            keys.add(key)
+            writer.append(rows)
+            progress.update(len(rows))
+    except BaseException:
+        # Features of the images processed so far are cached: running again resumes from here
+        writer.discard()
+        raise
+    finally:
+        if pool:
+            pool.terminate()
+    writer.close()
 
-    df.to_csv(os.path.join(OUTPUT, 'dataset.csv'))
\ No newline at end of file
+    #Drop the features of images which were removed (or changed)
+    for entry in os.listdir(CACHE):
+        if entry.split('.')[0] not in keys:
+            os.remove(os.path.join(CACHE, entry))
@@ -1,44 +1,123 @@
 import sys
 import os
-sys.path.append('./libs')
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './libs'))
 
-from joblib import dump
+from joblib import dump, Parallel, delayed
 
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler
 
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import BaseEnsemble, RandomForestClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.svm import SVC
 import dataset as d
 
-def build_models():
-    classifiers = {
+def get_path(classes, clf):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models/%s/%s.joblib' % (classes, clf))
+
+"""Search algorithm of the nearest neighbors classifiers: 'brute', 'kd_tree' or 'ball_tree'.
+With as many features as ours, trees prune little of the search, and a brute force search
+of all the regions of an image at once is the fastest (see benchmarks/knn.py)"""
+KNN_ALGORITHM = 'brute'
+
+def get_classifiers(knn_algorithm=KNN_ALGORITHM):
+    """
+    Returns a new (untrained) instance of every classifier, by model name.
+
+    Parameters
+    ----------
+    knn_algorithm : string
+        Search algorithm of the nearest neighbors classifiers (see KNN_ALGORITHM).
+    """
+    return {
         'random_forest': RandomForestClassifier(random_state=42, n_estimators=100),
         'naive_bayes': GaussianNB(),
-        '1nn': KNeighborsClassifier(1),
-        '3nn': KNeighborsClassifier(1),
-        '5nn': KNeighborsClassifier(1),
+        '1nn': KNeighborsClassifier(1, algorithm=knn_algorithm),
+        '3nn': KNeighborsClassifier(3, algorithm=knn_algorithm),
+        '5nn': KNeighborsClassifier(5, algorithm=knn_algorithm),
         'decision_tree': DecisionTreeClassifier(random_state=42),
         'svm': SVC(C=10, cache_size=200, class_weight=None, coef0=0.0,
             decision_function_shape='ovr', degree=3, gamma='scale', kernel='rbf',
             max_iter=-1, probability=False, random_state=42, shrinking=True,
             tol=0.001, verbose=False)
     }
-    general = d.remove_extras(d.general(d.read('./dataset.csv')))
-    Xg = general[general.columns[:-1]]
-    yg = general[general.columns[-1]]
-
-    specific = d.remove_extras(d.specific(d.read('./dataset.csv')))
-    Xs = specific[specific.columns[:-1]]
-    ys = specific[specific.columns[-1]]
-
-    for clf in classifiers:
-        pipelined = make_pipeline(StandardScaler(), classifiers[clf])
-        pipelined.fit(Xg, yg)
-        get_path = lambda p: os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models/%s/%s.joblib' % (p, clf))
-        dump(pipelined, get_path('general'))
-        pipelined.fit(Xs, ys)
-        dump(pipelined, get_path('specific'))
\ No newline at end of file
+
+def fit(clf, X, y):
+    """
+    Trains a classifier.
+
+    Returns
+    -------
+    clf : sklearn classifier
+        The trained classifier.
+
+    seconds : float
+        How long training took.
+    """
+    start = time.time()
+    clf.fit(X, y)
+    return clf, time.time() - start
+
+def build_models(workers=1, knn_algorithm=KNN_ALGORITHM):
+    """
+    Trains every classifier (see "get_classifiers") for both sets of classes, and saves
+    them to models/<classes>/<model>.joblib as a pipeline of a StandardScaler and the
+    classifier.
+
+    The dataset is read once, and the scaler is fitted once per set of classes and shared
+    by all of its pipelines. Classifiers are independent of each other, so they are
+    trained in parallel.
+
+    Parameters
+    ----------
+    workers : int
+        Number of processes training classifiers at the same time, which is also the
+        number of jobs of the ensemble classifiers (trained one at a time, before the
+        others). 0 uses one per CPU.
+
+    knn_algorithm : string
+        Search algorithm of the nearest neighbors classifiers (see KNN_ALGORITHM).
+
+    Returns
+    -------
+    report : list of dicts
+        The 'classes', 'model', training time ('fit_seconds') and size of the saved
+        file ('bytes') of each model.
+    """
+    workers = workers or os.cpu_count()
+    df = d.remove_extras(d.read('./dataset'))
+
+    report = []
+    for classes, labels in [('general', d.general), ('specific', d.specific)]:
+        data = labels(df)
+        X = data[data.columns[:-1]]
+        y = data[data.columns[-1]]
+        scaler = StandardScaler().fit(X)
+        Xt = scaler.transform(X)
+
+        classifiers = get_classifiers(knn_algorithm)
+        # Ensembles are parallel on their own, the others are trained side by side
+        ensembles = [m for m in classifiers if isinstance(classifiers[m], BaseEnsemble)]
+        others = [m for m in classifiers if m not in ensembles]
+
+        trained = {}
+        for m in ensembles:
+            classifiers[m].set_params(n_jobs=workers)
+            trained[m] = fit(classifiers[m], Xt, y)
+            trained[m][0].set_params(n_jobs=None) # models predict in the serving processes' own threads
+        results = Parallel(n_jobs=min(workers, len(others)))(delayed(fit)(classifiers[m], Xt, y) for m in others)
+        trained.update(zip(others, results))
+
+        for m in classifiers:
+            clf, seconds = trained[m]
+            path = get_path(classes, m)
+            # Uncompressed, so it can be memory-mapped (see model_registry). The new file replaces
+            # the old one instead of overwriting it, as processes may still have the old one mapped
+            dump(make_pipeline(scaler, clf), path + '.tmp', compress=0)
+            os.replace(path + '.tmp', path)
+            report.append({'classes': classes, 'model': m, 'fit_seconds': seconds, 'bytes': os.path.getsize(path)})
+            print('%-8s %-15s fitted in %7.2fs, %9.1f KB' % (classes, m, seconds, report[-1]['bytes'] / 1024))
+    return report
@@ -1,54 +1,258 @@
-from sklearn.externals import joblib
 import sys
 import os
+import multiprocessing
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './libs'))
 
 import preprocessor
 import subimages
 import features
+import keypoints
+from model_registry import registry
+from extraction_cache import cache
 
 import cv2
 import numpy as np
 
-import matplotlib
-import matplotlib.cm as cm
-
 def get_path(p):
     return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), p))
 
 font = cv2.FONT_HERSHEY_DUPLEX
 
-def classify(img, classes='general', model='random_forest'):
+"""Pixels shared by neighboring tiles, when images are segmented in tiles"""
+TILE_OVERLAP = 256
 
-    clf = joblib.load(get_path('../models/%s/%s.joblib' % (classes, model)))
-    classlist = list(clf.classes_)
+def extract(full_image, tile_size=None):
+    """
+    Finds the regions of interest of an image and computes their features.
 
-    norm = matplotlib.colors.Normalize(vmin=0, vmax=len(classlist) - 1, clip=True)
-    mapper = cm.ScalarMappable(norm=norm, cmap=cm.Set1)
-    
-    colored = img.copy()
-    full_image = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    STROKE = int(0.015 * np.min(full_image.shape))
-    
-    imgw, _ = full_image.shape
+    Parameters
+    ----------
+    full_image : opencv image
+        A grayscale image.
+
+    tile_size : int
+        Images larger than this (in width or height) are segmented in overlapping tiles
+        of this size (see subimages.extract_tiled), which bounds the memory used. None
+        segments every image at once.
 
+    Returns
+    -------
+    contours : list of opencv contours
+        The contours of the regions which have features.
 
-    rois = subimages.extract(full_image, preprocessor.default_ensemble)
+    X : numpy array of shape (len(contours), number of features)
+        The features of each region, one per row.
+    """
+    if tile_size and max(full_image.shape[:2]) > tile_size:
+        rois, context = subimages.extract_tiled(full_image, preprocessor.default_ensemble, tile_size, min(TILE_OVERLAP, tile_size // 2))
+    else:
+        context = keypoints.KeypointContext(full_image)
+        rois = subimages.extract(full_image, preprocessor.default_ensemble, context)
+    contours, vectors = [], []
     for (cropped, cnt) in rois:
-        vector = features.get(full_image, cropped, cnt)
+        vector = features.get(cropped, full_image, cnt, context=context)
         if(vector is False):
             continue #skip it
+        contours.append(cnt)
+        vectors.append(vector)
+    return contours, np.array(vectors, dtype=np.float64).reshape(len(vectors), len(features.get_labels()))
+
+def _extract_colored(img, tile_size=None):
+    return extract(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), tile_size)
+
+def _cache_key(img, tile_size):
+    # Hashing the image is skipped when there is no cache to look it up in
+    if not cache.enabled:
+        return None
+    return cache.key(img, 'tiles-%d' % tile_size if tile_size and max(img.shape[:2]) > tile_size else '')
+
+def extract_cached(img, tile_size=None):
+    """
+    Returns the regions of interest and features of a colored image (see "extract"),
+    from the extraction cache when the same image was already extracted.
+    """
+    key = _cache_key(img, tile_size)
+    cached = cache.get(key) if key else None
+    if cached is not None:
+        return cached
+    contours, X = _extract_colored(img, tile_size)
+    if key:
+        cache.put(key, contours, X)
+    return contours, X
+
+def predict(clf, X, proba=False):
+    """
+    Classifies every row of X with a single call to the model.
+
+    Parameters
+    ----------
+    clf : sklearn Pipeline
+        A trained model.
+
+    X : numpy array
+        Features, one row per region.
+
+    proba : bool
+        Whether the probability of each prediction should be returned as well.
+
+    Returns
+    -------
+    predictions : list of strings
+
+    probabilities : numpy array | None
+        The probability of each prediction, if requested and supported by the model.
+    """
+    if len(X) == 0:
+        return [], (np.zeros(0) if proba else None)
+    if not proba:
+        return list(clf.predict(X)), None
+    try:
+        probabilities = clf.predict_proba(X)
+    except AttributeError: # e.g. SVC without probability estimates
+        return list(clf.predict(X)), None
+    return list(clf.classes_[probabilities.argmax(axis=1)]), probabilities.max(axis=1)
+
+def detect(img, classes='general', model='random_forest', proba=False, tile_size=None):
+    """
+    Finds and classifies every region of interest of an image, without drawing anything.
+
+    Parameters
+    ----------
+    img : opencv image
+        A colored image.
+
+    classes : string
+        The set of classes ('general' or 'specific').
+
+    model : string
+        The model name, e.g. 'random_forest'.
+
+    proba : bool
+        Whether the probability of each class should be computed (when the model supports it).
+
+    tile_size : int
+        Images larger than this are segmented in tiles (see "extract").
+
+    Returns
+    -------
+    detections : list of dicts
+        One per region, with its bounding rectangle ('box', as x, y, w, h), 'contour',
+        'class' and 'probability' (None if not computed).
+    """
+    clf = registry.get(classes, model)
+    contours, X = extract_cached(img, tile_size)
+    return _detections(contours, *predict(clf, X, proba))
+
+def _detections(contours, predictions, probabilities):
+    return [{
+        'box': tuple(cv2.boundingRect(cnt)),
+        'contour': cnt,
+        'class': str(pred),
+        'probability': None if probabilities is None else float(probabilities[i])
+    } for i, (cnt, pred) in enumerate(zip(contours, predictions))]
+
+def detect_batch(imgs, classes='general', model='random_forest', proba=False, workers=1, tile_size=None):
+    """
+    Finds and classifies the regions of interest of many images. Features of the images
+    not in the extraction cache are extracted in parallel, and the regions of all images are predicted in a single call to the model.
+
+    Parameters
+    ----------
+    imgs : list of opencv images
+        Colored images.
+
+    classes : string
+        The set of classes ('general' or 'specific').
 
-        x,y,w,h = cv2.boundingRect(cnt)
-        pred = clf.predict([vector])[0]
+    model : string
+        The model name, e.g. 'random_forest'.
 
-        color = np.array(mapper.cmap(classlist.index(pred))[:-1]) * 255
+    proba : bool
+        Whether the probability of each class should be computed (when the model supports it).
+
+    workers : int
+        Number of processes extracting features. 1 extracts them in this process,
+        and 0 uses one process per CPU.
+
+    tile_size : int
+        Images larger than this are segmented in tiles (see "extract").
+
+    Returns
+    -------
+    detections : list of lists of dicts
+        The detections of each image, as returned by "detect".
+    """
+    if len(imgs) == 0:
+        return []
+    clf = registry.get(classes, model)
+
+    keys = [_cache_key(img, tile_size) for img in imgs]
+    extracted = [cache.get(key) if key else None for key in keys]
+    missing = [i for (i, e) in enumerate(extracted) if e is None]
+
+    workers = min(workers or os.cpu_count(), len(missing))
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.starmap(_extract_colored, [(imgs[i], tile_size) for i in missing])
+    else:
+        results = [_extract_colored(imgs[i], tile_size) for i in missing]
+    for i, (contours, X) in zip(missing, results):
+        if keys[i]:
+            cache.put(keys[i], contours, X)
+        extracted[i] = (contours, X)
+
+    predictions, probabilities = predict(clf, np.vstack([X for (_, X) in extracted]), proba)
+    result, start = [], 0
+    for (contours, _) in extracted:
+        end = start + len(contours)
+        result.append(_detections(contours, predictions[start:end], None if probabilities is None else probabilities[start:end]))
+        start = end
+    return result
+
+def class_list(classes='general', model='random_forest'):
+    """
+    Returns every class a model can predict, which "render" uses to choose their colors.
+    """
+    return [str(c) for c in registry.get(classes, model).classes_]
+
+"""Colors of each class, by their position in the class list (matplotlib's Set1)"""
+COLORS = [(228, 26, 28), (55, 126, 184), (77, 175, 74), (152, 78, 163), (255, 127, 0),
+          (255, 255, 51), (166, 86, 40), (247, 129, 191), (153, 153, 153)]
+
+def render(img, detections, classlist):
+    """
+    Draws the bounding rectangle and class of each detection on a copy of the image.
+
+    Parameters
+    ----------
+    img : opencv image
+        The original colored image.
+
+    detections : list of dicts
+        The detections, as returned by "detect".
+
+    classlist : list of strings
+        Every class of the model (see "class_list"), so each one gets its own color.
+
+    Returns
+    -------
+    colored : opencv image
+    """
+    colored = img.copy()
+    STROKE = int(0.015 * np.min(img.shape[:2]))
+    
+    imgw = img.shape[0]
+
+    for detection in detections:
+        x,y,w,h = detection['box']
+        pred = detection['class']
+
+        color = COLORS[min(classlist.index(pred), len(COLORS) - 1)]
         cv2.rectangle(colored,(x,y),(x+w,y+h),color,STROKE)
 
 
         csize = len(pred)
         #texto
-        print(w/(20*csize), imgw/1000)
         tsize = max(w/(20*csize), imgw/1000)
         tweight = max(int(3*tsize), 3)
 
@@ -59,4 +263,41 @@ def classify(img, classes='general', model='random_forest'):
 
         cv2.putText(colored, pred,(xpos,ypos), font, tsize, color, tweight, cv2.LINE_AA)
 
-    return colored
\ No newline at end of file
+    return colored
+
+def classify(img, classes='general', model='random_forest'):
+    """
+    Classifies every region of interest of an image and draws the results on it.
+    Equivalent to "render" applied to the result of "detect".
+
+    Parameters
+    ----------
+    img : opencv image
+        A colored image.
+
+    classes : string
+        The set of classes ('general' or 'specific').
+
+    model : string
+        The model name, e.g. 'random_forest'.
+
+    Returns
+    -------
+    colored : opencv image
+        The image, annotated with the class of each region.
+    """
+    return render(img, detect(img, classes, model), class_list(classes, model))
+
+def classify_batch(imgs, classes='general', model='random_forest', workers=1):
+    """
+    Classifies the regions of interest of many images (see "detect_batch") and draws
+    the results on them.
+
+    Returns
+    -------
+    colored : list of opencv images
+        The images, annotated with the class of each region.
+    """
+    classlist = class_list(classes, model)
+    detections = detect_batch(imgs, classes, model, workers=workers)
+    return [render(img, d, classlist) for img, d in zip(imgs, detections)]
@@ -0,0 +1,136 @@
+"""
+Compares the classifiers trained by build_models with stratified k-fold cross validation,
+reporting their accuracy next to their cost (training time, prediction latency and size),
+so the fastest model that is accurate enough can be chosen.
+"""
+import sys
+import os
+import csv
+import pickle
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './libs'))
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+import build_models
+import dataset as d
+
+COLUMNS = ['classes', 'model', 'accuracy', 'accuracy_std', 'f1', 'f1_std', 'fit_seconds', 'roi_ms', 'bytes']
+
+def evaluate_fold(clf, X, y, train, test):
+    """
+    Trains a model on a fold's training set and measures it on its test set. This is the
+    unit of work of the worker processes.
+
+    Returns
+    -------
+    result : dict
+        The 'accuracy' and macro averaged 'f1' of the predictions, the training time
+        ('fit_seconds'), the prediction time per region ('roi_seconds', predicting the
+        whole test set at once) and the size of the pickled model ('bytes').
+    """
+    model = make_pipeline(StandardScaler(), clone(clf))
+    start = time.perf_counter()
+    model.fit(X[train], y[train])
+    fitted = time.perf_counter()
+    predictions = model.predict(X[test])
+    predicted = time.perf_counter()
+    return {
+        'accuracy': accuracy_score(y[test], predictions),
+        'f1': f1_score(y[test], predictions, average='macro'),
+        'fit_seconds': fitted - start,
+        'roi_seconds': (predicted - fitted) / len(test),
+        'bytes': len(pickle.dumps(model, protocol=4))
+    }
+
+def evaluate(classes=('general', 'specific'), models=None, folds=5, workers=1, balance=True):
+    """
+    Cross validates the classifiers of build_models.
+
+    Parameters
+    ----------
+    classes : list of strings
+        The sets of classes to evaluate ('general' and/or 'specific').
+
+    models : list of strings
+        The model names (see build_models.get_classifiers). None evaluates all of them.
+
+    folds : int
+        Number of folds. Classes with fewer examples than folds are left out.
+
+    workers : int
+        Number of processes training folds at the same time. 0 uses one per CPU.
+
+    balance : bool
+        Whether every class is downsampled to the size of the smallest one
+        (see dataset.balance_by_min), so the accuracy is not dominated by the largest ones.
+
+    Returns
+    -------
+    report : list of dicts
+        One per set of classes and model, with the values of COLUMNS: the mean and
+        standard deviation over the folds of the accuracy and F1 score, and the mean
+        training time, prediction time per region (in milliseconds) and model size.
+    """
+    df = d.remove_extras(d.read('./dataset'))
+    classifiers = build_models.get_classifiers()
+    models = models or list(classifiers)
+
+    report = []
+    for c in classes:
+        data = d.remove_below(folds)(d.general(df) if c == 'general' else d.specific(df))
+        if balance:
+            data = d.balance_by_min(data)
+        X = data.drop('class', axis=1).values.astype(np.float64)
+        y = data['class'].astype(str).values
+
+        splits = list(StratifiedKFold(folds, shuffle=True, random_state=42).split(X, y))
+        tasks = [(m, train, test) for m in models for (train, test) in splits]
+        results = Parallel(n_jobs=workers or -1)(delayed(evaluate_fold)(classifiers[m], X, y, train, test) for (m, train, test) in tasks)
+
+        for m in models:
+            r = [result for (task, result) in zip(tasks, results) if task[0] == m]
+            mean = lambda key: float(np.mean([f[key] for f in r]))
+            std = lambda key: float(np.std([f[key] for f in r]))
+            report.append({'classes': c, 'model': m,
+                           'accuracy': mean('accuracy'), 'accuracy_std': std('accuracy'),
+                           'f1': mean('f1'), 'f1_std': std('f1'),
+                           'fit_seconds': mean('fit_seconds'), 'roi_ms': 1000 * mean('roi_seconds'),
+                           'bytes': int(mean('bytes'))})
+    return report
+
+def print_report(report, min_accuracy=None):
+    """
+    Prints the report of "evaluate" as a table, sorted by prediction time. If an accuracy
+    floor is given, also prints the fastest model of each set of classes that meets it.
+    """
+    print('%-9s %-14s %16s %16s %9s %9s %10s' % ('classes', 'model', 'accuracy', 'F1', 'fit s', 'ROI ms', 'size KB'))
+    for c in sorted(set(r['classes'] for r in report)):
+        rows = sorted((r for r in report if r['classes'] == c), key=lambda r: r['roi_ms'])
+        for r in rows:
+            print('%-9s %-14s %8.3f +- %.3f %8.3f +- %.3f %9.2f %9.4f %10.1f' % (c, r['model'], r['accuracy'], r['accuracy_std'],
+                  r['f1'], r['f1_std'], r['fit_seconds'], r['roi_ms'], r['bytes'] / 1024))
+        if min_accuracy is not None:
+            accurate = [r for r in rows if r['accuracy'] >= min_accuracy]
+            print('Fastest %s model with accuracy >= %.3f: %s' % (c, min_accuracy, accurate[0]['model'] if accurate else 'none'))
+
+def run(classes=('general', 'specific'), models=None, folds=5, workers=1, balance=True, min_accuracy=None, output=None):
+    """
+    Evaluates the models (see "evaluate"), prints the report and, if output is given,
+    writes it to a csv file.
+    """
+    report = evaluate(classes, models, folds, workers, balance)
+    print_report(report, min_accuracy)
+    if output:
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, COLUMNS)
+            writer.writeheader()
+            writer.writerows(report)
+    return report
@@ -0,0 +1,211 @@
+"""
+Keeps the regions of interest and features extracted from images, keyed by a hash of
+the image contents, so classifying an image again (e.g. with another model) only runs
+the prediction, not the segmentation and feature extraction.
+
+The cache is disabled unless it is given a size or a directory, as hashing every image
+only pays off when the same images are classified again, e.g. by the web app.
+"""
+import sys
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), './libs'))
+
+import numpy as np
+
+import features
+
+class ExtractionCache:
+    """
+    A least recently used cache of extracted regions of interest and features.
+
+    Entries are kept in memory and, if a directory is given, on disk as well, where they
+    outlive the process and are shared by every process using the same directory.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size of the entries kept in memory. 0 keeps none in memory.
+
+    directory : string
+        Where entries are stored on disk. None means memory only.
+
+    max_disk_bytes : int
+        Maximum total size of the entries stored on disk.
+    """
+    def __init__(self, max_bytes=0, directory=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        """Whether entries are kept anywhere, in memory or on disk"""
+        return bool(self.max_bytes or self.directory)
+
+    def key(self, img, variant=''):
+        """
+        Returns the key of an image: a hash of its pixels and of the feature
+        extraction version.
+
+        Parameters
+        ----------
+        img : opencv image
+
+        variant : string
+            Distinguishes the results of different extraction settings for the same image.
+
+        Returns
+        -------
+        key : string
+        """
+        h = hashlib.sha1(b'features-v%d:%s:%s:%s:' % (features.VERSION, variant.encode(), str(img.shape).encode(), img.dtype.str.encode()))
+        h.update(np.ascontiguousarray(img).data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the regions of interest and features of an image, as returned by
+        classify.extract, or None if they are not cached.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._add(key, entry)
+        return entry
+
+    def put(self, key, contours, X):
+        """
+        Stores the regions of interest and features of an image.
+
+        Parameters
+        ----------
+        key : string
+            The key of the image (see "key").
+
+        contours : list of opencv contours
+
+        X : numpy array
+            The features of each region, one per row.
+        """
+        X.setflags(write=False) # shared by every later hit
+        entry = (contours, X)
+        with self._lock:
+            if self.max_bytes:
+                self._add(key, entry)
+        if self.directory:
+            self._store(key, entry)
+
+    def _add(self, key, entry):
+        if key in self._entries:
+            self._bytes -= _size(self._entries.pop(key))
+        self._entries[key] = entry
+        self._bytes += _size(entry)
+        while self._entries and self._bytes > self.max_bytes:
+            self._bytes -= _size(self._entries.popitem(last=False)[1])
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                X, points, lengths = data['X'], data['points'], data['lengths']
+        except (OSError, ValueError, KeyError): # missing or partially written
+            return None
+        os.utime(self._path(key)) # marks it as recently used
+        X.setflags(write=False)
+        return list(np.split(points, np.cumsum(lengths)[:-1])) if len(lengths) else [], X
+
+    def _store(self, key, entry):
+        contours, X = entry
+        os.makedirs(self.directory, exist_ok=True)
+        points = np.concatenate(contours) if contours else np.zeros((0, 1, 2), np.int32)
+        lengths = np.array([len(c) for c in contours], np.int64)
+        tmp = self._path(key) + '.%d.tmp' % os.getpid()
+        with open(tmp, 'wb') as f:
+            np.savez(f, X=X, points=points, lengths=lengths)
+        os.replace(tmp, self._path(key))
+        self._prune()
+
+    def _prune(self):
+        """
+        Deletes the least recently used entries on disk until they fit in max_disk_bytes.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError: # deleted by another process
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for (_, size, _) in files)
+        for (_, size, name) in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Removes every entry from memory (entries on disk are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Returns the cache metrics.
+
+        Returns
+        -------
+        stats : dict
+            Hits in memory, hits on disk, misses, evictions from memory, number of
+            entries in memory and their size.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+def _size(entry):
+    contours, X = entry
+    return X.nbytes + sum(c.nbytes for c in contours)
+
+"""The cache shared by the whole process, disabled until it is configured (see ui.web.app.configure)"""
+cache = ExtractionCache()
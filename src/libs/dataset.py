@@ -1,12 +1,160 @@
 from typing import Callable
+import json
 import os
+import shutil
+import numpy as np
 import pandas as pd
 
-from sklearn.preprocessing import scale
-
 def read(name):
+    """Reads a dataset. Names ending in `.csv` are read as csv files, other names as the
+    columnar format (see `write_columnar`), falling back to `name.csv` if there is none."""
     f = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', name))
-    return pd.read_csv(f, encoding='latin-1', index_col=0)
+    if not f.endswith('.csv') and not os.path.exists(f + '.json'):
+        f += '.csv'
+    if f.endswith('.csv'):
+        return pd.read_csv(f, encoding='latin-1', index_col=0)
+    return read_columnar(f)
+
+def write_columnar(df: pd.DataFrame, path: str):
+    """Writes a dataset in a compact columnar format, made of three files:
+
+    - `path.npy`: float32 matrix with the numeric columns;
+    - `path.labels.npy`: int32 matrix with the codes of the other (label) columns;
+    - `path.json`: column names and types, and the categories of each label column.
+    """
+    labels = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
+    writer = Writer(path, list(df.columns), labels, csv=False)
+    for start in range(0, len(df), writer.batch):
+        writer.append(df.iloc[start:start + writer.batch].values.tolist())
+    writer.close()
+
+class Writer:
+    """Writes a dataset row by row, in the columnar format (see `write_columnar`) and,
+    optionally, as `path.csv`. Rows are flushed to disk every `batch` rows, so the
+    dataset is never held in memory as a whole.
+
+    Everything is written to `.part` files, which only replace the previous dataset
+    when `close` is called: an interrupted run never leaves a partial dataset behind,
+    and keeps the previous one.
+    """
+    def __init__(self, path: str, columns: list, labels: list, csv: bool = True, batch: int = 1000):
+        self.path = path
+        self.columns = columns
+        self.labels = labels
+        self.numeric = [c for c in columns if c not in labels]
+        self.csv = csv
+        self.batch = batch
+        self.rows = 0
+        self._pending = []
+        self._integer = [True] * len(self.numeric)
+        self._categories = [{} for _ in labels]
+        self._numeric_idx = [columns.index(c) for c in self.numeric]
+        self._labels_idx = [columns.index(c) for c in labels]
+        self._matrix = open(path + '.npy.part', 'wb')
+        self._codes = open(path + '.labels.npy.part', 'wb')
+        self._csv = open(path + '.csv.part', 'w', newline='') if csv else None
+
+    def append(self, rows: list):
+        """Appends rows (lists of values, in the order of `columns`)."""
+        self._pending += rows
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending rows to disk."""
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+
+        numeric = [[r[i] for i in self._numeric_idx] for r in rows]
+        for j in range(len(self.numeric)):
+            if self._integer[j]:
+                self._integer[j] = all(isinstance(r[j], (int, np.integer)) for r in numeric)
+        np.array(numeric, np.float32).reshape(len(rows), len(self.numeric)).tofile(self._matrix)
+
+        codes = np.empty((len(rows), len(self.labels)), np.int32)
+        for j, i in enumerate(self._labels_idx):
+            categories = self._categories[j]
+            codes[:, j] = [categories.setdefault(str(r[i]), len(categories)) for r in rows]
+        codes.tofile(self._codes)
+
+        if self._csv:
+            index = range(self.rows, self.rows + len(rows))
+            pd.DataFrame(rows, columns=self.columns, index=index).to_csv(self._csv, header=self.rows == 0)
+        self.rows += len(rows)
+
+    def close(self):
+        """Flushes the pending rows, and moves the dataset into place. Without the csv
+        output, the csv file of the previous dataset is removed, as it would be stale."""
+        self.flush()
+        if self._csv:
+            if self.rows == 0:
+                pd.DataFrame([], columns=self.columns).to_csv(self._csv)
+            self._csv.close()
+            os.replace(self.path + '.csv.part', self.path + '.csv')
+
+        for f, name, dtype, width in [(self._matrix, '.npy', np.float32, len(self.numeric)),
+                                      (self._codes, '.labels.npy', np.int32, len(self.labels))]:
+            f.close()
+            _to_npy(self.path + name + '.part', self.path + name + '.tmp', dtype, (self.rows, width))
+
+        with open(self.path + '.json.part', 'w') as meta:
+            json.dump({
+                'columns': self.columns,
+                'numeric': self.numeric,
+                'integer': [c for c, integer in zip(self.numeric, self._integer) if integer],
+                'labels': self.labels,
+                'categories': {c: list(categories) for c, categories in zip(self.labels, self._categories)},
+                'rows': self.rows
+            }, meta)
+
+        # Every file is complete before any is moved into place, so only a crash between
+        # these renames mixes datasets, which read_columnar detects by their row counts
+        os.replace(self.path + '.json.part', self.path + '.json')
+        os.replace(self.path + '.npy.tmp', self.path + '.npy')
+        os.replace(self.path + '.labels.npy.tmp', self.path + '.labels.npy')
+        if not self._csv and os.path.exists(self.path + '.csv'):
+            os.remove(self.path + '.csv')
+
+    def discard(self):
+        """Closes and removes the `.part` files, leaving the previous dataset untouched."""
+        for f in [self._matrix, self._codes, self._csv]:
+            if f:
+                f.close()
+                os.remove(f.name)
+
+def _to_npy(raw: str, path: str, dtype, shape: tuple):
+    """Turns a raw binary file into a .npy file, copying it in blocks."""
+    with open(path, 'wb') as out, open(raw, 'rb') as f:
+        np.lib.format.write_array_header_1_0(out, {
+            'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            'fortran_order': False,
+            'shape': shape
+        })
+        shutil.copyfileobj(f, out)
+    os.remove(raw)
+
+def read_columnar(path: str) -> pd.DataFrame:
+    """Reads a dataset written by `write_columnar` or `Writer`. The matrices are memory-mapped, and the
+    float columns are read-only views of them, not copies. Integer columns are converted, and the
+    label columns are returned as categoricals.
+
+    Raises ValueError if the files are not of the same dataset (e.g. a build was killed while
+    moving them into place)."""
+    with open(path + '.json') as meta:
+        meta = json.load(meta)
+    matrix = np.load(path + '.npy', mmap_mode='r')
+    codes = np.load(path + '.labels.npy', mmap_mode='r')
+    rows = meta.get('rows', len(matrix))
+    if matrix.shape != (rows, len(meta['numeric'])) or codes.shape != (rows, len(meta['labels'])):
+        raise ValueError('The files of the dataset %s do not match, build it again' % path)
+
+    columns = {}
+    for i, c in enumerate(meta['numeric']):
+        columns[c] = matrix[:, i].astype(np.int64) if c in meta['integer'] else matrix[:, i]
+    for i, c in enumerate(meta['labels']):
+        columns[c] = pd.Categorical.from_codes(codes[:, i], meta['categories'][c])
+    return pd.DataFrame(columns, columns=meta['columns'], copy=False)
 
 def remove_extras(df: pd.DataFrame) -> pd.DataFrame:
     """Removes the filename, x, y, w and h cols"""
@@ -27,7 +175,7 @@ def specific(df: pd.DataFrame) -> pd.DataFrame:
 def remove_below(n: int) -> Callable[[pd.DataFrame], pd.DataFrame]:
     """Returns a function which takes a dataframe and removes all classes whose count is less than the minimum specified"""
     def rem(df: pd.DataFrame) -> pd.DataFrame:
-        return df.groupby('class').filter(lambda x: len(x) >= n)
+        return df.groupby('class', observed=True).filter(lambda x: len(x) >= n)
     return rem
 
 #downsampling
@@ -35,7 +183,7 @@ def balance_by_min(df: pd.DataFrame) -> pd.DataFrame:
     """Returns a downsampled dataset."""
     if 'class' not in df.columns:
         raise ValueError('No class column present in DataFrame. Please apply the `general` or `specific` functions before.')
-    g = df.groupby('class')
+    g = df.groupby('class', observed=True)
     size = g.size().min()
     return g.apply(lambda x: x.sample(size, random_state=0)).reset_index(drop=True)
 
@@ -43,7 +191,7 @@ def split_by_min(df: pd.DataFrame) -> tuple :
     """Returns a downsampled dataset and the remainder of the dataset."""
     if 'class' not in df.columns:
         raise ValueError('No class column present in DataFrame. Please apply the `general` or `specific` functions before.')
-    g = df.groupby('class')
+    g = df.groupby('class', observed=True)
     size = g.size().min()
     sampled = g.apply(lambda x: x.sample(size, random_state=0))
     return sampled.reset_index(drop=True), df.drop(sampled.index.droplevel()).reset_index(drop=True)
@@ -4,20 +4,17 @@ Generates all features.
 """
 
 import cv2
-import math
 import numpy as np
-import os
-import pandas as pd
+import keypoints
 import shape_features
-import utilities as utils
-import sys
 
+"""Version of the feature extraction (segmentation included). Increase it whenever
+the features of an image change, so cached features are computed again. Note that
+full_keypoint_count is deliberately computed from a second ORB detection on each
+cropped image (see "orb_features"), as the models were trained: counting the shared
+keypoints of the full image instead would change the feature."""
+VERSION = 5
 
-if utils.CV_V3 or utils.CV_V4:
-    orb = cv2.ORB_create()
-else:
-    orb = cv2.ORB()
-        
 def orb_labels(orb_number=5):
     """
     Returns the labels (column names) generated by "orb_features".
@@ -33,50 +30,126 @@ def orb_labels(orb_number=5):
     """
     return [ "distance_%02d" % i for i in range(orb_number)] + ['distance_mean','distance_std', 'keypoint_count', 'keypoint_hull_area', 'full_keypoint_count']
 
-def orb_features(cropped, full, cnt, orb_number=5):
+def pairwise_distances(points):
+    """
+    Returns the euclidean distance between every pair of points, in condensed form:
+    the distances of the pairs (i, j) with i < j, ordered by i and then by j.
+
+    Parameters
+    ----------
+    points : numpy array of shape (n, 2)
+        The points (for instance, keypoint coordinates).
+
+    Returns
+    -------
+    distances : numpy array of shape (n*(n-1)/2,)
+    """
+    i, j = np.triu_indices(len(points), 1)
+    diff = points[i] - points[j]
+    return np.sqrt((diff * diff).sum(axis=1))
+
+def smallest(values, n):
+    """
+    Returns the n smallest values, sorted. Only those values are sorted, instead of all of them.
+
+    Parameters
+    ----------
+    values : numpy array
+        The values to be selected from.
+
+    n : int
+        How many values should be returned.
+
+    Returns
+    -------
+    smallest : numpy array
+    """
+    n = min(n, len(values))
+    if n == 0:
+        return values[:0]
+    return np.sort(np.partition(values, n - 1)[:n])
+
+def keypoint_features(points, orb_number=5):
+    """
+    Returns the features of a set of keypoints: the orb_number smallest distances
+    between them, the mean and standard deviation of all of the distances, the number
+    of keypoints and the area of their convex hull.
+
+    Parameters
+    ----------
+    points : numpy array of shape (n, 2)
+        The keypoints, in the order they were detected.
+
+    orb_number : int
+        Number of distances that should be returned.
+
+    Returns
+    -------
+    features : array | False
+        False if there are less than orb_number keypoints.
+    """
+    size = len(points)
+    if(size < orb_number):
+        return False # Acho melhor remover, pois se não tem descritores, é um mau exemplo (pode ser fundo ou sla)
+
+    distances = pairwise_distances(points)
+    mean = np.mean(distances)
+    std = np.std(distances)
+    top_distances = smallest(distances, orb_number).tolist()
+
+    polygon_area = cv2.contourArea(cv2.convexHull(points.reshape(-1, 1, 2).astype('float32')))
+    return top_distances + [mean, std, size, polygon_area]
+
+def orb_features(cropped, full, cnt, orb_number=5, context=None):
     """
     Returns all features regarding ORB. Meaning:
     - Top-N-Distances
     - Mean of all distances
     - Standard deviation of all distances
 
+    These are the features the models were trained with. The distances, the keypoint
+    count and their hull area are those of every keypoint of the full image (see
+    "keypoint_features"), so they are computed once per image and shared by all of its
+    regions. The last feature counts the keypoints of the cropped image, in its own
+    coordinates, which lie inside the contour. Changing any of them requires training
+    the models again (see VERSION).
+
+    That is why the keypoints of the cropped image are detected again for every region,
+    instead of using "context": ORB finds different keypoints on a crop than on the full
+    image, so passing "context" to get_number_of_full_keypoints would be faster, but
+    would silently change a feature the models depend on.
+
     Parameters
     ----------
-    img : opencv image
+    cropped : opencv image
         The cropped portion of the image.
 
+    full : opencv image
+        The full original unprocessed image.
+
+    cnt : opencv contour
+        The contour of the cropped object, with respect to the coordenates of "full".
+
     orb_number : int
         Number of distances that ORB should return.
 
+    context : keypoints.KeypointContext
+        The keypoints of "full". If not given, they are detected here.
+
     Returns
     -------
     features: array
     """
-
-    # Compute the descriptors with ORB
-    kp = orb.detect(cropped, None)
-    distances = []
-    size = len(kp)
-    
-    if(size < orb_number):
-        return False # Acho melhor remover, pois se não tem descritores, é um mau exemplo (pode ser fundo ou sla)
-    
-    for i in range(size):
-        a = np.array(kp[i].pt)
-        for j in range(i+1,size):
-            b = np.array(kp[j].pt)
-            distances.append(np.linalg.norm(a-b))
-
-    mean = np.mean(distances)
-    std = np.std(distances)
-    distances.sort()
-    top_distances = distances[:orb_number]
-    
-    points = np.array( [ [k.pt] for k in kp], dtype='float32')
-    polygon_area = cv2.contourArea(cv2.convexHull(points))
-    features = top_distances + [mean,std, size, polygon_area, get_number_of_full_keypoints(full, cnt)]
-    
-    return features
+    if context is None:
+        context = keypoints.KeypointContext(full)
+
+    key = ('keypoint_features', orb_number)
+    if key not in context.shared:
+        context.shared[key] = keypoint_features(context.detected, orb_number)
+    features = context.shared[key]
+    if(features is False):
+        return False
+    return features + [get_number_of_full_keypoints(cropped, cnt)]
 
 def get_labels(orb_number=5):
     """
@@ -93,11 +166,30 @@ def get_labels(orb_number=5):
     """
     return orb_labels(orb_number) + shape_features.get_labels()
 
-def get_number_of_full_keypoints(full, cnt):
-    full_kp = orb.detect(full, None)
-    return sum([cv2.pointPolygonTest(cnt, k.pt, False) > -1 for k in full_kp])
+def get_number_of_full_keypoints(full, cnt, context=None):
+    """
+    Returns how many keypoints of an image lie inside the contour.
+
+    Parameters
+    ----------
+    full : opencv image
+        The image whose keypoints are counted.
+
+    cnt : opencv contour
+        The contour of the object.
+
+    context : keypoints.KeypointContext
+        The keypoints of "full". If not given, they are detected here.
+
+    Returns
+    -------
+    count : int
+    """
+    if context is None:
+        context = keypoints.KeypointContext(full)
+    return len(context.in_contour(cnt))
 
-def get(cropped, full, cnt, orb_number=5):
+def get(cropped, full, cnt, orb_number=5, context=None):
     """
     Calculates features regarding ORB as well as shape features.
     If ORB fails, returns False, indicating that the object lacks information.
@@ -116,12 +208,18 @@ def get(cropped, full, cnt, orb_number=5):
     orb_number : int
         Number of distances that ORB should return.
 
+    context : keypoints.KeypointContext
+        The keypoints of "full", shared by all of its regions of interest.
+        If not given, they are detected here.
+
     Returns
     -------
     features : array of all features | False
     """
-    orb = orb_features(cropped, full, cnt, orb_number)
+    orb = orb_features(cropped, full, cnt, orb_number, context)
     if(orb is False):
         return False
-    sf = shape_features.get(full, cnt) #Calls the shape_features module
+    # As the models were trained: the pixels are read from the cropped image, at the
+    # coordinates of the contour in the full image (see orb_features)
+    sf = shape_features.get(cropped, cnt) #Calls the shape_features module
     return orb + sf
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Detects the ORB keypoints of a full image once, so that they can be shared by
+the segmentation step ("subimages") and by every region of interest ("features").
+"""
+import cv2
+import numpy as np
+import utilities as utils
+
+def create_detector():
+    """
+    Creates an ORB detector, regardless of the OpenCV version.
+
+    Returns
+    -------
+    orb : opencv ORB detector
+    """
+    if utils.CV_V3 or utils.CV_V4:
+        return cv2.ORB_create()
+    else:
+        return cv2.ORB()
+
+def detect(image):
+    """
+    Detects the ORB keypoints of an image.
+
+    Returns
+    -------
+    points : numpy array of shape (n, 2)
+        The (x, y) coordinates of the keypoints.
+    """
+    kp = create_detector().detect(image, None)
+    return np.array([k.pt for k in kp], dtype=np.float64).reshape(-1, 2)
+
+"""Width, in pixels, of the band along a contour's border where the filled mask of
+the contour may disagree with cv2.pointPolygonTest (see KeypointContext.in_contour)"""
+BORDER = 5
+
+class KeypointContext:
+    """
+    The ORB keypoints of a full image. Keypoints are detected a single time and
+    kept sorted by their x coordinate, so the ones inside a region can be found
+    by binary search instead of testing every keypoint.
+
+    Parameters
+    ----------
+    image : opencv image
+        The full original unprocessed image.
+
+    Attributes
+    ----------
+    detected : numpy array of shape (n, 2)
+        The keypoints, in the order they were detected.
+
+    shared : dict
+        Values computed from the keypoints once per image and shared by all of its
+        regions (see features.orb_features).
+    """
+    def __init__(self, image):
+        self._set_points(detect(image))
+
+    def _set_points(self, points):
+        self.detected = points
+        self.points = points[np.argsort(points[:, 0], kind='stable')]
+        self.shared = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def in_window(self, x1, y1, x2, y2):
+        """
+        Returns the keypoints inside an axis aligned window, that is, the ones
+        with x1 <= x < x2 and y1 <= y < y2.
+
+        Returns
+        -------
+        points : numpy array of shape (n, 2)
+        """
+        lo, hi = np.searchsorted(self.points[:, 0], [x1, x2], side='left')
+        candidates = self.points[lo:hi]
+        ys = candidates[:, 1]
+        return candidates[(ys >= y1) & (ys < y2)]
+
+    def in_contour(self, cnt):
+        """
+        Returns the keypoints inside (or on the border of) a contour, exactly as
+        cv2.pointPolygonTest(cnt, pt, False) > -1 would. Only the keypoints inside
+        the contour's bounding rectangle are tested. They are first looked up, all
+        at once, on a mask of the filled contour the size of that rectangle. The
+        mask is only accurate away from the border, so the keypoints on or near the
+        drawn border (a band of BORDER pixels) are tested with pointPolygonTest.
+
+        Parameters
+        ----------
+        cnt : opencv contour
+            A contour, with respect to the coordinates of the full image.
+
+        Returns
+        -------
+        points : numpy array of shape (n, 2)
+        """
+        x, y, w, h = cv2.boundingRect(cnt)
+        candidates = self.in_window(x, y, x + w, y + h)
+        if len(candidates) == 0:
+            return candidates
+
+        mask = np.zeros((h, w), np.uint8)
+        cv2.drawContours(mask, [cnt], -1, 1, -1, offset=(-x, -y))
+        cv2.drawContours(mask, [cnt], -1, 2, BORDER, offset=(-x, -y))
+
+        cols = np.clip(np.rint(candidates[:, 0]).astype(int) - x, 0, w - 1)
+        rows = np.clip(np.rint(candidates[:, 1]).astype(int) - y, 0, h - 1)
+        found = mask[rows, cols]
+        inside = found == 1
+        for i in np.flatnonzero(found == 2):
+            inside[i] = cv2.pointPolygonTest(cnt, tuple(candidates[i]), False) > -1
+        return candidates[inside]
@@ -11,9 +11,59 @@ a "contourizable" image.
 """
 import cv2
 import numpy as np
-import utilities
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-def otsu(img, KERNEL_SIZE = 5):
+class SharedIntermediates:
+    """ Intermediate results shared by the preprocessors of an ensemble, such as
+    the Otsu threshold of the image. Each one is computed only once per image,
+    even when requested by several threads at the same time.
+
+    Results are shared, so they must not be modified in place.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, key, compute):
+        """ Returns the intermediate result identified by key, calling compute() if
+        it has not been computed yet.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the intermediate result.
+
+        compute : function
+            Computes the result, when needed.
+
+        Returns
+        -------
+        result : any
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+def _otsu_threshold(img, cache=None):
+    """ Otsu's binarization of the original image, shared through cache when given.
+
+    Returns
+    -------
+    (threshold, binarized) : tuple
+    """
+    compute = lambda: cv2.threshold(img,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    return compute() if cache is None else cache.get('otsu', compute)
+
+def otsu(img, KERNEL_SIZE = 5, cache=None):
     """ Transforms the image using otsu binarizarion method. It also applies floodFill
     to the top left corner, trying to get all closed shapes.
 
@@ -25,12 +75,15 @@ def otsu(img, KERNEL_SIZE = 5):
     KERNEL_SIZE : int
         Kernel size for the "opening" morphological transformation.
 
+    cache : SharedIntermediates
+        Intermediate results shared with other preprocessors of the same image.
+
     Returns
     -------
     transformed : opencv image
     """
     #Apply otsu threshold, so we can separate background(white) from foreground(black)
-    _,otsu = cv2.threshold(img,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    _,otsu = _otsu_threshold(img, cache)
 
     #Remove noise from image
     kernel = np.ones((KERNEL_SIZE,KERNEL_SIZE),np.uint8)
@@ -47,7 +100,7 @@ def otsu(img, KERNEL_SIZE = 5):
 
     return noholes
 
-def otsu_triangles(img, KERNEL_SIZE = 5):
+def otsu_triangles(img, KERNEL_SIZE = 5, cache=None):
     """ Transforms the image using otsu binarizarion method, similar to the "otsu" function on this module.
     The only difference, however, is that this version draws a small triangle (5 percent of img's width) on each of the four corners,
     and applies floodFill to all of them, instead of just one.
@@ -60,16 +113,19 @@ def otsu_triangles(img, KERNEL_SIZE = 5):
     KERNEL_SIZE : int
         Kernel size for the "opening" morphological transformation.
 
+    cache : SharedIntermediates
+        Intermediate results shared with other preprocessors of the same image.
+
     Returns
     -------
     transformed : opencv image
     """
 
-    _, otsu = cv2.threshold(img,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    _, otsu = _otsu_threshold(img, cache)
 
     return _remove_holes_with_triangles(otsu, KERNEL_SIZE)
 
-def canny(img):
+def canny(img, cache=None):
     """ Transforms the image using canny edge recongnition method. Blurs the image
     a little as well, to make it more likely that edges touch.
 
@@ -78,15 +134,18 @@ def canny(img):
     img : opencv image
         An image to be processed
 
+    cache : SharedIntermediates
+        Intermediate results shared with other preprocessors of the same image.
+
     Returns
     -------
     transformed : opencv image
     """
-    thresh, _ = cv2.threshold(img,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    thresh, _ = _otsu_threshold(img, cache)
     edges = cv2.Canny(img, 0.3*thresh, 0.6*thresh)
     return cv2.GaussianBlur(edges,(15,15),0)
 
-def sprinkles(img, KERNEL_SIZE=5):
+def sprinkles(img, KERNEL_SIZE=5, cache=None):
     """ Temporary name. Uses the mean adaptive threshold, blurs the image and applis otsu. Then, it applies the triangle on corners method
     The intent here is to prevent stains on the background from being recognized as objects.
 
@@ -98,6 +157,9 @@ def sprinkles(img, KERNEL_SIZE=5):
     KERNEL_SIZE : int
         Kernel size for the "opening" morphological transformation.
 
+    cache : SharedIntermediates
+        Intermediate results shared with other preprocessors of the same image.
+
     Returns
     -------
     transformed : opencv image
@@ -167,7 +229,7 @@ def _remove_holes_with_triangles(binarized, KERNEL_SIZE):
     return cv2.bitwise_not(opening) | cv2.bitwise_not(copy) # Combine the two images to get the hole-free image.
 
 
-def project(img):
+def project(img, cache=None):
     """Preprocessor made for Computer Vision classes"""
     h, w = img.shape[:2]
     
@@ -215,7 +277,7 @@ def project(img):
 
     return im_out
 
-def new_process(img):
+def new_process(img, cache=None):
     """A new trial using median blur"""
     k = np.array(img.shape).max()
     percent_of_k = lambda x: int((k//(200/x))*2+1)
@@ -233,7 +295,7 @@ def new_process(img):
     
     return _remove_holes_with_triangles(th, 5)
 
-def new_process_2(img):
+def new_process_2(img, cache=None):
     """Another trial using median blur"""
     k = np.array(img.shape).max()
     percent_of_k = lambda x: int((k//(200/x))*2+1)
@@ -260,23 +322,52 @@ def new_process_2(img):
     return _remove_holes_with_triangles(op, 5)
 
 
-def stacked(img):
+def stacked(img, cache=None):
     """Combining new_process and new_process_2"""
     k = np.array(img.shape).max()
     percent_of_k = lambda x: int((k//(200/x))*2+1)
     OPEN_SIZE = percent_of_k(2)
     
-    a, b = new_process(img), new_process_2(img)
+    a, b = new_process(img, cache=cache), new_process_2(img, cache=cache)
     ret = a|b
     op = cv2.morphologyEx(ret, cv2.MORPH_CLOSE, np.ones((OPEN_SIZE, OPEN_SIZE)))
     return (op)
 
-def ensemble(methods):
-    """Given a list of preprocessors, generates an ensemble with them"""
+def ensemble(methods, workers=None):
+    """Given a list of preprocessors, generates an ensemble with them.
+
+    The preprocessors run concurrently on a thread pool (OpenCV releases the GIL),
+    sharing intermediate results through a SharedIntermediates cache, and their
+    outputs are added to a running vote as soon as each one finishes.
+
+    Parameters
+    ----------
+    methods : list of functions
+        Preprocessors of this module. Each one is called as m(img, cache=cache).
+
+    workers : int
+        Number of threads. Defaults to one per method; 1 runs them sequentially.
+
+    Returns
+    -------
+    pp : function
+    """
     size = len(methods)
     th = (255*size) * .2
+    workers = workers or size
     def pp(img):
-        ret = np.sum([m(img) for m in methods], axis=0) <= th
+        cache = SharedIntermediates()
+        # uint16 holds the sum of up to 257 uint8 outputs
+        votes = np.zeros(img.shape[:2], np.uint16)
+        if workers == 1:
+            for m in methods:
+                np.add(votes, m(img, cache=cache), out=votes)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(m, img, cache=cache) for m in methods]
+                for f in as_completed(futures):
+                    np.add(votes, f.result(), out=votes)
+        ret = votes <= th
         ret = 255*(ret.astype(np.uint8))
         
         return _remove_holes_with_triangles(ret, 5)
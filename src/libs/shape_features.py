@@ -36,11 +36,13 @@ import cv2
 import mahotas
 import numpy as np
 import sys
-import matplotlib.pyplot as plt
+from functools import lru_cache
 from os.path import (basename)
 import utilities
 
 def dump(img, noholes, otsu, cnt, hull, name, area):
+    import matplotlib.pyplot as plt # Only needed for debugging, and slow to import
+
     SHOW = True
     truename = basename(name)[:-4]
     truename = truename + " (area = %s)" % area
@@ -78,7 +80,7 @@ def get_labels ():
             "convexity2", "convexity3"] + ["hu%d"%d for d in range(7)] + \
             ["har%d"%d for d in range(13)]
 
-def crop_box(image, rect):
+def crop_box(image, rect, offset=(0, 0)):
     """
     Given an opencv Image and a RotatedRect, returns a cropped version of the image.
 
@@ -90,15 +92,15 @@ def crop_box(image, rect):
     rect : opencv RotatedRect
         A box which defines the image's crop area
 
+    offset : tuple (x, y)
+        Position of "image" inside the image "rect" refers to, when "image" is
+        a window of it.
+
     Returns
     -------
     cropped : opencv image
     """
-    if utilities.CV_V3 or utilities.CV_V4:
-        box = cv2.boxPoints(rect)
-    else:
-        box = cv2.cv.BoxPoints(rect)
-    box = np.int0(box)
+    box = np.int0(get_box_points(rect)) - np.array(offset)
 
     W = rect[1][0]; H = rect[1][1]
 
@@ -125,7 +127,64 @@ def crop_box(image, rect):
     croppedW = W if not rotated else H; croppedH = H if not rotated else W
     return cv2.getRectSubPix(cropped, (int(croppedW), int(croppedH)), (size[0]/2, size[1]/2))
 
-def get_rect_features(image, contour):
+def get_box_points(rect):
+    """
+    Returns the four corners of a RotatedRect, regardless of the OpenCV version.
+
+    Parameters
+    ----------
+    rect : opencv RotatedRect
+        A rotated box.
+
+    Returns
+    -------
+    box : numpy array of shape (4, 2)
+    """
+    if utilities.CV_V3 or utilities.CV_V4:
+        return cv2.boxPoints(rect)
+    else:
+        return np.array(cv2.cv.BoxPoints(rect))
+
+def get_window(image, contour, rects, margin=2):
+    """
+    Returns the part of the image needed to compute the features of a contour:
+    its bounding rectangle, enlarged to contain the given rotated boxes and a
+    small margin, and clipped to the image (keeping at least its nearest border
+    pixel, which is what the parts of the boxes outside of the image read).
+
+    Parameters
+    ----------
+    image : opencv image
+        The full image.
+
+    contour : opencv contour
+        The contour of the object.
+
+    rects : list of opencv RotatedRect
+        Rotated boxes (such as the minimum area rectangle and the fitted ellipse)
+        that must lie inside the window.
+
+    margin : int
+        Extra pixels added around the window.
+
+    Returns
+    -------
+    window : tuple (x1, y1, x2, y2)
+    """
+    x, y, w, h = cv2.boundingRect(contour)
+    x1, y1, x2, y2 = x, y, x + w, y + h
+    for rect in rects:
+        box = get_box_points(rect)
+        x1 = min(x1, int(np.floor(box[:, 0].min())))
+        y1 = min(y1, int(np.floor(box[:, 1].min())))
+        x2 = max(x2, int(np.ceil(box[:, 0].max())) + 1)
+        y2 = max(y2, int(np.ceil(box[:, 1].max())) + 1)
+    height, width = image.shape[:2]
+    # Boxes outside the image read its nearest border, so the window keeps at least that
+    return (min(max(x1 - margin, 0), width - 1), min(max(y1 - margin, 0), height - 1),
+            min(x2 + margin, width), min(y2 + margin, height))
+
+def get_rect_features(image, contour, rect=None, offset=(0, 0)):
     """
     Calculates features regarding the minimum area rectangle enclosing the contour.
 
@@ -137,6 +196,13 @@ def get_rect_features(image, contour):
     contour : opencv contour
         The contour of the object.
 
+    rect : opencv RotatedRect
+        The minimum area rectangle of the contour. If not given, it is computed
+        from the contour.
+
+    offset : tuple (x, y)
+        Position of "image" inside the image the contour and "rect" refer to.
+
     Returns
     -------
     rect_mean : float
@@ -148,14 +214,40 @@ def get_rect_features(image, contour):
     major_axis : float
         Length of the minor axis
     """
-    rect = cv2.minAreaRect(contour)
-    croppedRotated = crop_box(image, rect)
+    if rect is None:
+        rect = cv2.minAreaRect(contour)
+    croppedRotated = crop_box(image, rect, offset)
     height, width = croppedRotated.shape[:2]
     large = np.max([height, width])
     small = np.min([height, width])
     return (np.mean(croppedRotated), np.float(small)/large, small ,large)
 
-def get_el_mean(image, contour):
+@lru_cache(maxsize=256)
+def get_el_mask(height, width):
+    """
+    Returns a mask of the pixels outside of the ellipse inscribed in a crop of the
+    given size. Masks are cached, as crops of the same size share the same mask.
+
+    Parameters
+    ----------
+    height : int
+        Height of the crop.
+
+    width : int
+        Width of the crop.
+
+    Returns
+    -------
+    mask : read-only numpy boolean array of shape (height, width)
+    """
+    centerx, centery = (width/2,height/2)
+    xs = (np.arange(width, dtype=np.float64) - centerx)**2/(centerx)**2
+    ys = (np.arange(height, dtype=np.float64) - centery)**2/(centery)**2
+    mask = xs[np.newaxis, :] + ys[:, np.newaxis] > 1
+    mask.flags.writeable = False
+    return mask
+
+def get_el_mean(image, contour, ellipse=None, offset=(0, 0)):
     """
     Calculates features regarding the ellipse enclosing the contour.
 
@@ -167,6 +259,13 @@ def get_el_mean(image, contour):
     contour : opencv contour
         The contour of the object.
 
+    ellipse : opencv RotatedRect
+        The ellipse fitted to the contour. If not given, it is computed from the
+        contour.
+
+    offset : tuple (x, y)
+        Position of "image" inside the image the contour and "ellipse" refer to.
+
     Returns
     -------
     ellipse_mean : float
@@ -174,21 +273,23 @@ def get_el_mean(image, contour):
     area : float
         Area of the ellipse
     """
-    ellipse = cv2.fitEllipse(contour)
-    croppedRotated = crop_box(image, ellipse)
+    if ellipse is None:
+        ellipse = cv2.fitEllipse(contour)
+    croppedRotated = crop_box(image, ellipse, offset)
     height, width = croppedRotated.shape[:2]
     ellipse_area = np.pi * height/2 * width/2
-    centerx, centery = (width/2,height/2)
     # We invert the pixels outside of the ellipse, so we can penalize them
-    for x in range(width):
-        for y in range(height):
-            if np.float(x-centerx)**2/(centerx)**2 + np.float(y-centery)**2/(centery)**2 > 1:
-                croppedRotated[y,x] = 255 - croppedRotated[y,x]
+    outside = get_el_mask(height, width)
+    croppedRotated[outside] = 255 - croppedRotated[outside]
     return np.mean(croppedRotated), ellipse_area
 
 def get(image, contour):
     """
-    Calculates all of the shape features of the image
+    Calculates all of the shape features of the image.
+
+    The rectangle and ellipse features only read a window of the image around the
+    contour. Hu moments and Haralick features describe the whole image, so it
+    should be a crop of the object (see features.get).
 
     Parameters
     ----------
@@ -196,7 +297,7 @@ def get(image, contour):
         An image to be processed.
 
     contour : opencv contour
-        The contour of the object.
+        The contour of the object, with respect to the coordinates of "image".
 
     Returns
     -------
@@ -216,7 +317,17 @@ def get(image, contour):
     waddel_circularity = 2 * equivalent_area_circle_r
     
 
-    rect_mean, aspect_ratio, _minor_axis, _major_axis = get_rect_features(image, contour)
+    rect = cv2.minAreaRect(contour)
+    try:
+        ellipse = cv2.fitEllipse(contour)
+    except: # Sometimes it won't get an ellipse
+        ellipse = None
+
+    # Window around the contour, containing both rotated boxes
+    x1, y1, x2, y2 = get_window(image, contour, [rect] if ellipse is None else [rect, ellipse])
+    window = image[y1:y2, x1:x2]
+
+    rect_mean, aspect_ratio, _minor_axis, _major_axis = get_rect_features(window, contour, rect, (x1, y1))
     rectangularity = area / (_minor_axis*_major_axis)
     eccentricity = np.sqrt(_major_axis**2 - _minor_axis**2)/_major_axis
 
@@ -228,24 +339,18 @@ def get(image, contour):
     convexity_2 = hull_perimeter / float(perimeter)
     convexity_3 = 2*(_minor_axis+_major_axis) / float(perimeter)
     
-    # Calculate Moments and Hu Moments
-    moments = cv2.moments(image)
-    huMoments = np.array([(-1) * np.copysign(1.0, h) * np.log10(abs(h)) for h in cv2.HuMoments(moments)]).flatten()
-    
     _, _, _bw, _bh = cv2.boundingRect(contour)
     bounding_area = _bw * _bh
     extent = float(area)/bounding_area
+
+    # Calculate Moments and Hu Moments
+    moments = cv2.moments(image)
+    huMoments = np.array([(-1) * np.copysign(1.0, h) * np.log10(abs(h)) for h in cv2.HuMoments(moments)]).flatten()
     
     try:
-        el_mean, ellipse_area = get_el_mean(image, contour)
+        el_mean, ellipse_area = get_el_mean(window, contour, ellipse, (x1, y1))
     except: # Sometimes it won't get an ellipse
         el_mean, ellipse_area = 0, 0
-        
-    mask = np.zeros(image.shape, np.uint8)
-    cv2.drawContours(mask, contour, -1, 255, -1)
-    
-    mean, std = cv2.meanStdDev(image, mask=mask)
-    mean, std = (mean[0][0], std[0][0])
     
     haralick = mahotas.features.haralick(image).mean(0)
     #zernike = mahotas.features.zernike_moments(image, 1)
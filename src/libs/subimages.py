@@ -2,7 +2,12 @@
 """
 Responsible for finding the regions of interest (subimages) on a given image.
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
+import numpy as np
+import keypoints
 import utilities as utils
 
 def find_contours(image):
@@ -24,7 +29,24 @@ def find_contours(image):
         contours, _ = cv2.findContours(image,cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
     return contours
 
-def get_contour_list(image, preprocessed, MIN_FILTER=3000):
+def get_window(cnt):
+    """ Given a contour, returns the square window around its minimum enclosing circle,
+    which is the area cropped from the original image.
+
+    Parameters
+    ----------
+    cnt : opencv contour
+        The contour of the object.
+
+    Returns
+    -------
+    window : tuple (x1, y1, x2, y2)
+    """
+    (x,y),r = cv2.minEnclosingCircle(cnt)
+    (x,y, r) = (int(max(r,x)), int(max(r,y)), int(r))
+    return (x-r, y-r, x+r, y+r)
+
+def get_contour_list(image, preprocessed, MIN_FILTER=3000, context=None):
     """ Given an image and its preprocessed version, returns the cropped image and its contours.
 
     The return value is in the format: [(CroppedImage, Contour)]
@@ -37,46 +59,70 @@ def get_contour_list(image, preprocessed, MIN_FILTER=3000):
     preprocessed: opencv image
         The processed image
 
+    MIN_FILTER : int
+        Contours with an area lower than this value are discarded
+
+    context : keypoints.KeypointContext
+        The keypoints of the original image. If not given, they are detected here.
+
+    Returns
+    -------
+    result : array of tuples
+    """
+    return select_contours(image, find_contours(preprocessed), MIN_FILTER, context) #gets contours in the preprocessed image
+
+def select_contours(image, contours, MIN_FILTER=3000, context=None):
+    """ Keeps the contours which are regions of interest of an image, and crops them.
+
+    The return value is in the format: [(CroppedImage, Contour)]
+
+    Parameters
+    ----------
+    image : opencv image
+        The original unprocessed image
+
+    contours : list of opencv contours
+        Contours found in the image, with respect to its coordinates.
+
     MIN_FILTER : int
         Contours with an area lower than this value are discarded
     
     MAX_FILTER_PERCENT: float
         Contours with dimensions that exceed this percentage of the image will be discarded
 
+    context : keypoints.KeypointContext
+        The keypoints of the original image. If not given, they are detected here.
+
     Returns
     -------
     result : array of tuples
     """
-    contours = find_contours(preprocessed) #gets contours in the preprocessed image
     result = []
-    
-    if utils.CV_V3 or utils.CV_V4:
-        orb = cv2.ORB_create()
-    else:
-        orb = cv2.ORB()
-    kp = orb.detect(image, None)
+
+    if context is None:
+        context = keypoints.KeypointContext(image)
     
     for cnt in contours:
         c_area = cv2.contourArea(cnt)
+
+        if(c_area <= MIN_FILTER): #FILTERING MIN SIZE, before the (more expensive) keypoint test
+            continue
         
-        has_keypoint = any([cv2.pointPolygonTest(cnt, k.pt, False) > -1 for k in kp])
+        has_keypoint = len(context.in_contour(cnt)) > 0
         if not has_keypoint:
             continue
                 
-        if(c_area > MIN_FILTER): #FILTERING MIN SIZE
-            if utils.DEBUG : print(cv2.contourArea(cnt))
-            (x,y),r = cv2.minEnclosingCircle(cnt)
-            (x,y, r) = (int(max(r,x)), int(max(r,y)), int(r))
-            
-            #FILTERING MAX SIZE
-            #if r > MAX_FILTER_PERCENT*image.shape[1] or r > MAX_FILTER_PERCENT*image.shape[0]:
-                #continue
-            
-            (y1,y2,x1,x2) = (y-r,y+r,x-r,x+r)
-            result.append( (image[y1:y2,x1:x2], cnt) )
+        if utils.DEBUG : print(cv2.contourArea(cnt))
+        (x1,y1,x2,y2) = get_window(cnt)
+        
+        #FILTERING MAX SIZE
+        #if r > MAX_FILTER_PERCENT*image.shape[1] or r > MAX_FILTER_PERCENT*image.shape[0]:
+            #continue
+        
+        result.append( (image[y1:y2,x1:x2], cnt) )
     return result
 
-def extract(img, preproc):
+def extract(img, preproc, context=None):
     """
     The method to be used outside this module. Takes an image and a preprocessing
     method, and return a list of tuples whose first position is the cropped image,
@@ -92,9 +138,226 @@ def extract(img, preproc):
         A function that will process the image, i.e., one of the functions available
         in the "preprocessor" module.
 
+    context : keypoints.KeypointContext
+        The keypoints of the image, so they can be reused when extracting features.
+        If not given, they are detected here.
+
     Returns
     -------
     result : array of tuples
     """
     if utils.DEBUG: utils.image_show(preproc(img))
-    return get_contour_list(img, preproc(img))
+    return get_contour_list(img, preproc(img), context=context)
+
+
+def get_tiles(shape, tile_size=2048, overlap=256):
+    """ Splits an image into overlapping tiles.
+
+    The image is partitioned into a grid of cores, of at most tile_size - overlap
+    pixels a side, and each tile is its core extended by overlap / 2 pixels on each
+    side (within the image).
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the image.
+
+    tile_size : int
+        Maximum width and height of a tile.
+
+    overlap : int
+        Number of pixels shared by neighboring tiles.
+
+    Returns
+    -------
+    tiles : list of tuples ((x1, y1, x2, y2), (cx1, cy1, cx2, cy2))
+        The window of each tile and of its core.
+    """
+    margin = overlap // 2
+    def bounds(length):
+        n = 1 if length <= tile_size else int(np.ceil(length / (tile_size - overlap)))
+        return np.linspace(0, length, n + 1).astype(int)
+
+    h, w = shape[:2]
+    xs, ys = bounds(w), bounds(h)
+    return [((max(0, cx1 - margin), max(0, cy1 - margin), min(w, cx2 + margin), min(h, cy2 + margin)), (cx1, cy1, cx2, cy2))
+            for (cy1, cy2) in zip(ys[:-1], ys[1:]) for (cx1, cx2) in zip(xs[:-1], xs[1:])]
+
+def _box_overlaps(boxes, box):
+    """ Returns the area of the intersection of the bounding rectangle box, (x, y, w, h),
+    with each of boxes (an array of bounding rectangles). """
+    x, y, w, h = box
+    return (np.clip(np.minimum(boxes[:, 0] + boxes[:, 2], x + w) - np.maximum(boxes[:, 0], x), 0, None) *
+            np.clip(np.minimum(boxes[:, 1] + boxes[:, 3], y + h) - np.maximum(boxes[:, 1], y), 0, None))
+
+def _process_tile(img, preproc, window, core, margin=2):
+    """ Segments a tile.
+
+    A contour touching a border of the tile which is not a border of the image is
+    clipped: the tile only sees part of the object, and the shape of that part may well
+    be an artifact of the clipping. Such contours are never kept as they are. Only their
+    parts inside the core are, to be joined with the parts of the same object kept by
+    the neighboring tiles when no tile sees it whole. A contour spanning the whole width
+    or height of the tile is mostly background, not an object.
+
+    Returns
+    -------
+    owned : list of opencv contours
+        The complete contours (not clipped) centered in the core.
+
+    others : list of opencv contours
+        The complete contours centered in the core of another tile.
+
+    pieces : list of opencv contours
+        The parts inside the core of the clipped contours.
+
+    All of them are with respect to the coordinates of the full image.
+    """
+    (x1, y1, x2, y2), (cx1, cy1, cx2, cy2) = window, core
+    h, w = img.shape[:2]
+    tile = img[y1:y2, x1:x2]
+
+    owned, others, pieces = [], [], []
+    for cnt in find_contours(preproc(tile)):
+        cnt = cnt + np.array([x1, y1], dtype=cnt.dtype)
+        x, y, bw, bh = cv2.boundingRect(cnt)
+        if bw >= x2 - x1 - 2 * margin or bh >= y2 - y1 - 2 * margin:
+            continue # spans the whole tile
+        clipped = ((x1 > 0 and x <= x1 + margin) or (y1 > 0 and y <= y1 + margin) or
+                   (x2 < w and x + bw >= x2 - margin) or (y2 < h and y + bh >= y2 - margin))
+        if not clipped:
+            center_x, center_y = x + bw // 2, y + bh // 2
+            (owned if cx1 <= center_x < cx2 and cy1 <= center_y < cy2 else others).append(cnt)
+            continue
+        # The part inside the core, drawn on a mask the size of that part only
+        px1, py1, px2, py2 = max(x, cx1), max(y, cy1), min(x + bw, cx2), min(y + bh, cy2)
+        if px1 >= px2 or py1 >= py2:
+            continue
+        mask = np.zeros((py2 - py1, px2 - px1), np.uint8)
+        cv2.drawContours(mask, [cnt], -1, 255, -1, offset=(-px1, -py1))
+        pieces.extend(piece + np.array([px1, py1], dtype=piece.dtype) for piece in find_contours(mask))
+
+    return owned, others, pieces
+
+def join_pieces(pieces):
+    """ Joins the parts of the objects kept by each tile (see "_process_tile"), which
+    touch each other across the borders between the cores, into the contours of the
+    objects. Parts of different tiles never overlap, as the cores do not.
+
+    Parameters
+    ----------
+    pieces : list of opencv contours
+
+    Returns
+    -------
+    joined : list of opencv contours
+    """
+    if not pieces:
+        return []
+    boxes = np.array([cv2.boundingRect(cnt) for cnt in pieces])
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+
+    # Groups the pieces whose bounding rectangles touch (union-find)
+    parent = list(range(len(pieces)))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i in range(len(pieces)):
+        touching = np.nonzero((x1[i+1:] <= x2[i]) & (x2[i+1:] >= x1[i]) & (y1[i+1:] <= y2[i]) & (y2[i+1:] >= y1[i]))[0] + i + 1
+        for j in touching:
+            parent[root(j)] = root(i)
+
+    groups = {}
+    for i in range(len(pieces)):
+        groups.setdefault(root(i), []).append(i)
+
+    joined = []
+    for group in groups.values():
+        if len(group) == 1:
+            joined.append(pieces[group[0]])
+            continue
+        # Drawn on a mask the size of the group only, where pieces which touch become one contour
+        gx, gy = x1[group].min(), y1[group].min()
+        mask = np.zeros((y2[group].max() - gy, x2[group].max() - gx), np.uint8)
+        cv2.drawContours(mask, [pieces[i] for i in group], -1, 255, -1, offset=(-int(gx), -int(gy)))
+        joined.extend(cnt + np.array([gx, gy], dtype=cnt.dtype) for cnt in find_contours(mask))
+    return joined
+
+def _add_unique(kept, contours, iou=0.5, contained=None):
+    """ Adds to kept the contours which are not duplicates of the ones already kept: those
+    whose bounding rectangle has an intersection over union of at least iou with the one
+    of a kept contour or, if contained is given, lies inside it by at least that fraction
+    of its area.
+    """
+    boxes = [cv2.boundingRect(cnt) for cnt in kept]
+    for cnt in contours:
+        box = cv2.boundingRect(cnt)
+        if boxes:
+            others = np.array(boxes)
+            area = box[2] * box[3]
+            intersection = _box_overlaps(others, box)
+            union = area + others[:, 2] * others[:, 3] - intersection
+            if (intersection >= iou * union).any() or (contained is not None and (intersection >= contained * area).any()):
+                continue
+        kept.append(cnt)
+        boxes.append(box)
+    return kept
+
+def extract_tiled(img, preproc, tile_size=2048, overlap=256, workers=None):
+    """
+    Equivalent to "extract", for images too large to be processed at once. The image is
+    split into overlapping tiles (see "get_tiles"), which are segmented in parallel. Each
+    object is kept once: as seen by the tile it is centered in, by another tile when that
+    one could not see it whole (it was clipped by a border of the tile), or, when no tile
+    could, joined from the parts of it inside the core of each tile.
+
+    Only a few tiles are processed at the same time, so the memory used by the
+    preprocessor is bounded by the tile size instead of the image size. Preprocessors
+    scale their kernels with the size of the image they are given, so tiles are
+    segmented at the scale of an image of tile_size pixels.
+
+    Parameters
+    ----------
+    img : opencv image
+        The image to be processed.
+
+    preproc : function
+        A function that will process the image, i.e., one of the functions available
+        in the "preprocessor" module.
+
+    tile_size : int
+        Maximum width and height of a tile.
+
+    overlap : int
+        Number of pixels shared by neighboring tiles. It should be larger than most
+        objects, as objects which no tile sees whole are joined from parts segmented
+        separately.
+
+    workers : int
+        Number of tiles processed at the same time. Defaults to one per CPU.
+
+    Returns
+    -------
+    result : array of tuples
+        As returned by "extract".
+
+    context : keypoints.KeypointContext
+        The keypoints of the image. They are detected on the whole image (while the
+        tiles are segmented), as the features of every region depend on all of them
+        (see features.orb_features).
+    """
+    tiles = get_tiles(img.shape, tile_size, overlap)
+    with ThreadPoolExecutor(max_workers=min(workers or os.cpu_count(), len(tiles))) as pool:
+        detection = pool.submit(keypoints.KeypointContext, img)
+        processed = list(pool.map(lambda t: _process_tile(img, preproc, *t), tiles))
+        context = detection.result()
+
+    # Objects seen whole by the tile they are centered in, then those seen whole by another
+    # tile only, and last those no tile saw whole, joined from the parts in each core
+    contours = [cnt for (owned, _, _) in processed for cnt in owned]
+    contours = _add_unique(contours, [cnt for (_, others, _) in processed for cnt in others])
+    contours = _add_unique(contours, join_pieces([cnt for (_, _, pieces) in processed for cnt in pieces]), contained=0.5)
+    return select_contours(img, contours, context=context), context
@@ -2,7 +2,7 @@
 Some commom utilities
 """
 import os
-import matplotlib.pyplot as plt
+import time
 import cv2
 
 CV_V3 = cv2.__version__[0] == "3"
@@ -58,6 +58,48 @@ def find_files(folder, filetypes=['jpg'], depth=float('inf')):
             result.append(completePath)
     return result
 
+class Throughput:
+    """
+    Keeps track of how many images and regions of interest were processed,
+    and reports the processing rate.
+
+    Parameters
+    ----------
+    total : int
+        How many images will be processed.
+
+    every : int
+        Reports after every "every" images.
+    """
+    def __init__(self, total, every=10):
+        self.total = total
+        self.every = every
+        self.images = 0
+        self.rois = 0
+        self.start = time.time()
+
+    def update(self, rois):
+        """
+        Registers one more processed image, reporting the rate if needed.
+
+        Parameters
+        ----------
+        rois : int
+            How many regions of interest the image had.
+        """
+        self.images += 1
+        self.rois += rois
+        if self.images % self.every == 0 or self.images == self.total:
+            self.report()
+
+    def report(self):
+        """
+        Prints how many images and regions of interest were processed, and their rate.
+        """
+        elapsed = max(time.time() - self.start, 1e-9)
+        print("%d/%d images, %d ROIs in %.1fs (%.2f images/s, %.2f ROIs/s)" %
+              (self.images, self.total, self.rois, elapsed, self.images/elapsed, self.rois/elapsed))
+
 def image_show_colored(img, title=''):
     """
     Dumps an colored image to the console
@@ -70,6 +112,8 @@ def image_show_colored(img, title=''):
     title: string
         The plot title
     """
+    import matplotlib.pyplot as plt # Only needed for debugging, and slow to import
+
     plt.figure(figsize=(10,10))
     plt.axis('off')
     plt.title(title)
@@ -0,0 +1,184 @@
+"""
+Keeps the trained models (models/<classes>/<model>.joblib) in memory, so each process
+loads a model from disk only once instead of on every classification.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+MODELS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models'))
+
+_Entry = namedtuple('_Entry', ['model', 'mtime', 'size'])
+
+class ModelRegistry:
+    """
+    A least recently used cache of trained models.
+
+    A model is reloaded when its file is modified (i.e. when its mtime changes), and
+    the least recently used models are evicted when the cache exceeds its caps.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of models kept in memory.
+
+    max_bytes : int
+        Maximum total size of the models kept in memory, estimated from their
+        file sizes. None means no limit.
+
+    root : string
+        The models directory.
+
+    mmap : bool
+        Whether the arrays of the models (e.g. the training set of the nearest neighbors
+        models, or the support vectors) are memory-mapped from their files instead of
+        read into memory. Mapped arrays load faster, and their pages are shared by every
+        process using the same model. Model files must then be replaced (as build_models
+        does), never rewritten in place, while they are in use.
+    """
+    def __init__(self, max_entries=14, max_bytes=None, root=MODELS, mmap=True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.root = root
+        self.mmap = mmap
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_time = 0.0
+
+    def path(self, classes, model):
+        """
+        Returns the path of a model file.
+
+        Parameters
+        ----------
+        classes : string
+            The set of classes ('general' or 'specific').
+
+        model : string
+            The model name, e.g. 'random_forest'.
+
+        Returns
+        -------
+        path : string
+        """
+        for name in (classes, model):
+            if not name or os.path.basename(name) != name or name.startswith('.'):
+                raise ValueError('Invalid model name: %s/%s' % (classes, model))
+        return os.path.join(self.root, classes, '%s.joblib' % model)
+
+    def available(self, classes):
+        """
+        Lists the models available for a set of classes.
+
+        Returns
+        -------
+        models : list of strings
+        """
+        return sorted(m[:-len('.joblib')] for m in os.listdir(os.path.join(self.root, classes)) if m.endswith('.joblib'))
+
+    def get(self, classes, model):
+        """
+        Returns a trained model, loading it if it is not in memory or if its file changed.
+
+        Parameters
+        ----------
+        classes : string
+            The set of classes ('general' or 'specific').
+
+        model : string
+            The model name, e.g. 'random_forest'.
+
+        Returns
+        -------
+        clf : sklearn Pipeline
+        """
+        key = (classes, model)
+        path = self.path(classes, model)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.mtime == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.model
+
+        from joblib import load # Deferred, so importing this module stays cheap
+
+        # Loaded outside the lock, so other models can still be served meanwhile
+        start = time.time()
+        clf = load(path, mmap_mode='r' if self.mmap else None)
+        elapsed = time.time() - start
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            self.load_time += elapsed
+            self._entries[key] = _Entry(clf, mtime, os.path.getsize(path))
+            self._entries.move_to_end(key)
+            self._evict()
+        return clf
+
+    def preload(self, classes=('general', 'specific')):
+        """
+        Loads every available model of the given sets of classes.
+
+        Parameters
+        ----------
+        classes : list of strings
+            The sets of classes whose models should be loaded.
+        """
+        for c in classes:
+            for m in self.available(c):
+                self.get(c, m)
+
+    def _evict(self):
+        # The most recent entry is always kept, even if it is larger than max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                (self.max_bytes is not None and self.size() > self.max_bytes)):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def size(self):
+        """
+        Returns the estimated size, in bytes, of the models in memory.
+        """
+        return sum(e.size for e in self._entries.values())
+
+    def clear(self):
+        """
+        Removes every model from memory.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache metrics.
+
+        Returns
+        -------
+        stats : dict
+            Hits, misses, reloads (due to modified files), evictions, total time spent
+            loading models (in seconds), number of models in memory and their size.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'evictions': self.evictions,
+                'load_time': self.load_time,
+                'entries': len(self._entries),
+                'bytes': self.size()
+            }
+
+"""The registry shared by the whole process"""
+registry = ModelRegistry()
@@ -9,7 +9,7 @@ import os
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../libs'))
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../'))
 
-from classify import classify
+from classify import detect, render, class_list
 import cv2
 
 def save_file():
@@ -24,7 +24,7 @@ def select_image(path):
     global panelA, panelB, saveBtn, saveImg
     image = cv2.imread(path)
     
-    classified = classify(image)
+    classified = render(image, detect(image), class_list())
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     saveImg = classified
     
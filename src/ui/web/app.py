@@ -1,37 +1,297 @@
 from flask import Flask, request, make_response
+from werkzeug.exceptions import HTTPException
 import numpy as np
 import cv2
+import threading
+import time
 app = Flask(__name__)
 import os
 
 import sys
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../'))
-from classify import classify
+from classify import detect, detect_batch, render, class_list
+from model_registry import registry
+from extraction_cache import cache
+from jobs import JobQueue, QueueFull
+
+"""Limits of the app, changed through `configure`"""
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024 # 32 MB per request
+_slots = None
+jobs = JobQueue()
+cache.max_bytes = 64 * 1024 * 1024 # the same images are often classified again, e.g. with another model
+
+def configure(max_concurrent=None, max_upload_mb=None, preload=False, job_workers=None, max_jobs=None,
+              cache_mb=None, cache_dir=None, jobs_dir=None):
+    """
+    Configures the app for serving.
+
+    Parameters
+    ----------
+    max_concurrent : int
+        Maximum number of classifications running at the same time in this process.
+        Requests beyond it are answered with 503 (Service Unavailable). None means no limit.
+
+    max_upload_mb : float
+        Maximum size of a request, in megabytes. Larger requests are answered with 413.
+
+    preload : bool
+        Whether every model should be loaded now, instead of on its first request.
+
+    job_workers : int
+        Number of jobs (see /jobs) run at the same time in this process.
+
+    max_jobs : int
+        Maximum number of jobs queued or running in this process. Jobs submitted
+        beyond it are answered with 503.
+
+    cache_mb : float
+        Size, in megabytes, of the in-memory cache of extracted features, which spares
+        extracting them again when the same image is classified again (e.g. with
+        another model). 0 disables it.
+
+    cache_dir : string
+        Directory where extracted features are cached on disk as well, shared by every
+        worker process. None means memory only.
+
+    jobs_dir : string
+        Directory where the status and results of jobs are kept, shared by every worker
+        process. None means a private temporary directory, only accessible by this user.
+    """
+    global _slots
+    _slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+    if job_workers:
+        jobs.workers = job_workers
+    if max_jobs:
+        jobs.max_pending = max_jobs
+    if jobs_dir:
+        jobs.directory = jobs_dir
+    jobs.root() # created now, so worker processes forked later share it
+    if cache_mb is not None:
+        cache.max_bytes = int(cache_mb * 1024 * 1024)
+    if cache_dir:
+        cache.directory = cache_dir
+    if max_upload_mb:
+        app.config['MAX_CONTENT_LENGTH'] = int(max_upload_mb * 1024 * 1024)
+    if preload:
+        registry.preload()
+
+def limited(view):
+    """Rejects requests to view while `max_concurrent` of them are already running."""
+    def wrapper(*args, **kwargs):
+        slots = _slots
+        if slots is None:
+            return view(*args, **kwargs)
+        if not slots.acquire(blocking=False):
+            return 'Server busy, try again later.', 503, {'Retry-After': '1'}
+        try:
+            return view(*args, **kwargs)
+        finally:
+            slots.release()
+    wrapper.__name__ = view.__name__
+    return wrapper
+
+def decode(file):
+    """
+    Decodes an uploaded image as a colored (3 channel) opencv image.
+    """
+    img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError('Could not decode %s as an image' % file.filename)
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+def to_json(img, detections):
+    """
+    Converts the detections of an image (see classify.detect) to a JSON serializable dict.
+    """
+    return {
+        'width': img.shape[1],
+        'height': img.shape[0],
+        'detections': [{
+            'box': dict(zip(('x', 'y', 'w', 'h'), map(int, d['box']))),
+            'class': d['class'],
+            'probability': d['probability']
+        } for d in detections]
+    }
+
+def timings(start, decoded, detected):
+    """
+    Returns the time spent decoding and classifying, from perf_counter values, in milliseconds.
+    """
+    ms = lambda t: round(1000 * t, 1)
+    return {'decode_ms': ms(decoded - start), 'detect_ms': ms(detected - decoded), 'total_ms': ms(detected - start)}
 
 @app.route('/')
 def hello_world():
     return app.send_static_file('index.html')
 
 @app.route('/classify', methods=['POST'])
+@limited
 def main():
     try:
         model = request.args.get('model', default = 'random_forest', type = str)
         classes = request.args.get('class', default = 'general', type = str)
 
-        img = cv2.imdecode(np.fromstring(request.files['file'].read(), np.uint8), cv2.IMREAD_UNCHANGED)
-        _, buffer = cv2.imencode('.png', classify(img, classes,  model))
+        img = decode(request.files['file'])
+        detections = detect(img, classes, model)
+        _, buffer = cv2.imencode('.png', render(img, detections, class_list(classes, model)))
         return (make_response(buffer.tobytes()), 200, {'Content-Type': 'image/png'})
+    except HTTPException: # e.g. upload too large
+        raise
     except Exception as e:
         return str(e), 404
 
+@app.route('/detect', methods=['POST'])
+@limited
+def detect_json():
+    """
+    Classifies an image like /classify, but answers with the detections as JSON instead
+    of an annotated image.
+    """
+    try:
+        model = request.args.get('model', default = 'random_forest', type = str)
+        classes = request.args.get('class', default = 'general', type = str)
+        proba = request.args.get('proba', default = 'false', type = str).lower() in ('1', 'true', 'yes')
+
+        tile_size = request.args.get('tile', default = None, type = int)
+
+        start = time.perf_counter()
+        img = decode(request.files['file'])
+        decoded = time.perf_counter()
+        detections = detect(img, classes, model, proba, tile_size)
+        detected = time.perf_counter()
+
+        result = to_json(img, detections)
+        result.update({
+            'classes': classes,
+            'model': model,
+            'timings': timings(start, decoded, detected)
+        })
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        return {'error': str(e)}, 404
+
+@app.route('/detect/batch', methods=['POST'])
+@limited
+def detect_batch_json():
+    """
+    Classifies every image uploaded (as 'files') in a single request. The model is loaded
+    once and the regions of interest of all images are predicted in a single call.
+    """
+    try:
+        model = request.args.get('model', default = 'random_forest', type = str)
+        classes = request.args.get('class', default = 'general', type = str)
+        proba = request.args.get('proba', default = 'false', type = str).lower() in ('1', 'true', 'yes')
+
+        files = request.files.getlist('files')
+        if not files:
+            raise ValueError('No images uploaded as "files"')
+
+        start = time.perf_counter()
+        imgs = [decode(f) for f in files]
+        decoded = time.perf_counter()
+        detections = detect_batch(imgs, classes, model, proba)
+        detected = time.perf_counter()
+
+        results = []
+        for f, img, d in zip(files, imgs, detections):
+            result = to_json(img, d)
+            result['filename'] = f.filename
+            results.append(result)
+        return {
+            'classes': classes,
+            'model': model,
+            'results': results,
+            'timings': timings(start, decoded, detected)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        return {'error': str(e)}, 404
+
+def detect_job(directory, img, classes, model, proba, annotate, tile_size=None):
+    """
+    Classifies an image in the background (see /jobs), optionally saving the annotated image.
+    """
+    start = time.perf_counter()
+    detections = detect(img, classes, model, proba, tile_size)
+    detected = time.perf_counter()
+    if annotate:
+        cv2.imwrite(os.path.join(directory, 'annotated.png'), render(img, detections, class_list(classes, model)))
+
+    result = to_json(img, detections)
+    result.update({
+        'classes': classes,
+        'model': model,
+        'timings': {'detect_ms': round(1000 * (detected - start), 1)}
+    })
+    return result
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queues the classification of an image, with the same parameters as /detect (and
+    'annotate' to save the annotated image as well), and answers with the job id at once.
+    """
+    try:
+        model = request.args.get('model', default = 'random_forest', type = str)
+        classes = request.args.get('class', default = 'general', type = str)
+        proba = request.args.get('proba', default = 'false', type = str).lower() in ('1', 'true', 'yes')
+        annotate = request.args.get('annotate', default = 'false', type = str).lower() in ('1', 'true', 'yes')
+        tile_size = request.args.get('tile', default = None, type = int)
+
+        if not os.path.isfile(registry.path(classes, model)): # fails now rather than in the job
+            raise ValueError('No such model: %s/%s' % (classes, model))
+        id = jobs.submit(detect_job, decode(request.files['file']), classes, model, proba, annotate, tile_size)
+        return {'id': id, 'status': 'queued'}, 202, {'Location': '/jobs/%s' % id}
+    except QueueFull as e:
+        return {'error': str(e)}, 503, {'Retry-After': '5'}
+    except HTTPException:
+        raise
+    except Exception as e:
+        return {'error': str(e)}, 404
+
+@app.route('/jobs/<id>', methods=['GET'])
+def job_status(id):
+    status = jobs.status(id)
+    if status is None:
+        return {'error': 'No such job'}, 404
+    return status
+
+@app.route('/jobs/<id>/result', methods=['GET'])
+def job_result(id):
+    """
+    Answers with the detections of a finished job, as /detect does. Jobs which are not
+    finished yet are answered with their status and 202, and failed jobs with 500.
+    """
+    status = jobs.status(id)
+    if status is None:
+        return {'error': 'No such job'}, 404
+    if status['status'] == 'failed':
+        return status, 500
+    if status['status'] != 'done':
+        return status, 202, {'Retry-After': '1'}
+    return jobs.result(id)
+
+@app.route('/jobs/<id>/image', methods=['GET'])
+def job_image(id):
+    path = jobs.file(id, 'annotated.png')
+    if path is None:
+        return {'error': 'No annotated image for this job (yet)'}, 404
+    with open(path, 'rb') as f:
+        return (make_response(f.read()), 200, {'Content-Type': 'image/png'})
+
 @app.route('/classifiers', methods=['GET'])
 def classifiers():
-    def get_models(p):
-        return [m.split('.')[0] for m in os.listdir('../../../models/%s' % p)]
-
     return {
-        'general': get_models('general'),
-        'specific': get_models('specific')
+        'general': registry.available('general'),
+        'specific': registry.available('specific')
     }
 
-app.run(debug=True)
\ No newline at end of file
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,179 @@
+"""
+Runs classifications in the background, so large images don't hold a request open
+until they are classified: submitting a job returns its id at once, and clients poll
+its status and fetch its result later.
+
+Jobs are run by a pool of threads of the process they were submitted to, but their
+status and results are written to disk, so any worker process of the server can answer
+the polls. No external broker is needed.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds `max_pending` jobs."""
+
+class JobQueue:
+    """
+    A bounded queue of jobs, run by a pool of threads.
+
+    Parameters
+    ----------
+    workers : int
+        Number of jobs run at the same time.
+
+    max_pending : int
+        Maximum number of jobs queued or running in this process. Submitting more
+        raises QueueFull, so the uploaded images waiting in memory stay bounded.
+
+    directory : string
+        Where the status and results of the jobs are written. None creates a private
+        temporary directory (only accessible by this user) when it is first needed.
+
+    ttl : float
+        Seconds after which finished jobs are deleted.
+    """
+    def __init__(self, workers=1, max_pending=16, directory=None, ttl=3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = None
+        self._pid = None
+
+    def submit(self, fn, *args):
+        """
+        Queues a job.
+
+        Parameters
+        ----------
+        fn : callable
+            Called as fn(directory, *args), where directory is the job's own directory
+            (e.g. to save images in it). Returns the result, a JSON serializable dict.
+
+        Returns
+        -------
+        id : string
+            The job id.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull('The job queue is full (%d jobs), try again later' % self.max_pending)
+            self._pending += 1
+            # Threads don't survive a fork, so each server process starts its own pool
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            executor = self._executor
+
+        # Once counted, the job must be released on any failure, or its slot is lost
+        try:
+            self._expire()
+            id = uuid.uuid4().hex
+            os.makedirs(self._path(id))
+            self._write(id, 'status.json', {'id': id, 'status': 'queued', 'submitted': time.time()})
+            executor.submit(self._run, id, fn, args)
+        except BaseException:
+            self._release()
+            raise
+        return id
+
+    def _run(self, id, fn, args):
+        status = self.status(id)
+        try:
+            status.update(status='running', started=time.time())
+            self._write(id, 'status.json', status)
+            result = fn(self._path(id), *args)
+            self._write(id, 'result.json', result)
+            status.update(status='done')
+        except Exception as e:
+            status.update(status='failed', error=str(e))
+        finally:
+            status['finished'] = time.time()
+            self._write(id, 'status.json', status)
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def status(self, id):
+        """
+        Returns the status of a job: its id, 'status' ('queued', 'running', 'done' or
+        'failed'), the times it was 'submitted', 'started' and 'finished' (as unix
+        timestamps) and, if it failed, its 'error'. None if there is no such job.
+        """
+        return self._read(id, 'status.json')
+
+    def result(self, id):
+        """
+        Returns the result of a finished job, or None if there is none (yet).
+        """
+        return self._read(id, 'result.json')
+
+    def file(self, id, name):
+        """
+        Returns the path of a file saved by a job, or None if there is no such file.
+        """
+        path = os.path.join(self._path(id), name) if self._valid(id) and os.path.basename(name) == name else None
+        return path if path and os.path.isfile(path) else None
+
+    def root(self):
+        """
+        Returns the directory where jobs are written, creating it if needed. Servers
+        with several processes call it before forking them, so they all share it.
+        """
+        with self._lock:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix='planktool-jobs-')
+            else:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            return self.directory
+
+    def pending(self):
+        """
+        Returns the number of jobs queued or running in this process.
+        """
+        with self._lock:
+            return self._pending
+
+    def _valid(self, id):
+        return re.fullmatch('[0-9a-f]{32}', id or '') is not None
+
+    def _path(self, id):
+        return os.path.join(self.root(), id)
+
+    def _read(self, id, name):
+        if not self._valid(id):
+            return None
+        try:
+            with open(os.path.join(self._path(id), name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, id, name, data):
+        # Written to a temporary file first, so readers never see partial files
+        path = os.path.join(self._path(id), name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def _expire(self):
+        """
+        Deletes the jobs that finished more than ttl seconds ago.
+        """
+        limit = time.time() - self.ttl
+        for id in os.listdir(self.root()):
+            status = self.status(id)
+            if status and status.get('finished', limit) < limit:
+                shutil.rmtree(self._path(id), ignore_errors=True)
@@ -0,0 +1,88 @@
+"""
+Serves the web interface in production, instead of Flask's single-threaded debug server.
+
+Uses gunicorn when it is installed (Linux and macOS), with several worker processes
+sharing the preloaded models, and waitress (one process, several threads) otherwise.
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app as web
+
+def serve(host='0.0.0.0', port=5000, workers=2, threads=4, max_concurrent=None, max_upload_mb=32, preload=True,
+          job_workers=1, max_jobs=16, cache_mb=64, cache_dir=None, jobs_dir=None):
+    """
+    Serves the web interface until interrupted.
+
+    Parameters
+    ----------
+    host : string
+        Address to listen on.
+
+    port : int
+        Port to listen on.
+
+    workers : int
+        Number of worker processes (gunicorn only).
+
+    threads : int
+        Number of threads handling requests in each worker process.
+
+    max_concurrent : int
+        Maximum number of classifications running at the same time in each worker process;
+        requests beyond it are answered with 503. Defaults to the number of threads.
+
+    max_upload_mb : float
+        Maximum size of a request, in megabytes.
+
+    preload : bool
+        Whether every model is loaded before serving. With gunicorn, models are loaded
+        once, before the worker processes are forked, so their memory is shared.
+
+    job_workers : int
+        Number of background jobs (see /jobs) run at the same time in each worker process.
+
+    max_jobs : int
+        Maximum number of background jobs queued or running in each worker process;
+        jobs submitted beyond it are answered with 503.
+
+    cache_mb : float
+        Size, in megabytes, of the cache of extracted features of each worker process.
+
+    cache_dir : string
+        Directory where extracted features are cached on disk as well. None means memory only.
+
+    jobs_dir : string
+        Directory where the status and results of background jobs are kept. None means a
+        private temporary directory, only accessible by this user.
+    """
+    web.configure(max_concurrent or threads, max_upload_mb, preload, job_workers, max_jobs, cache_mb, cache_dir, jobs_dir)
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        BaseApplication = None
+
+    if BaseApplication is not None:
+        class Server(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', '%s:%d' % (host, port))
+                self.cfg.set('workers', workers)
+                self.cfg.set('threads', threads)
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('preload_app', True)
+                self.cfg.set('timeout', 300) # large images take a while
+
+            def load(self):
+                return web.app
+
+        Server().run()
+    else:
+        try:
+            from waitress import serve as waitress_serve
+        except ImportError:
+            raise ImportError('Serving requires gunicorn or waitress: pip install gunicorn (or waitress)')
+        print('gunicorn is not available, serving with waitress in a single process')
+        waitress_serve(web.app, host=host, port=port, threads=threads)
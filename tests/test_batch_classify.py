@@ -0,0 +1,27 @@
+import csv
+
+import cv2
+import numpy as np
+
+import batch_classify
+import classify
+from model_registry import registry
+
+def test_bad_images_are_skipped(tmp_path, monkeypatch, capsys):
+    images = tmp_path / 'images'
+    images.mkdir()
+    cv2.imwrite(str(images / 'a.png'), np.zeros((20, 30, 3), np.uint8))
+    (images / 'b.png').write_bytes(b'not an image')
+    cv2.imwrite(str(images / 'c.png'), np.zeros((20, 30, 3), np.uint8))
+    monkeypatch.setattr(registry, 'get', lambda classes, model: None)
+    monkeypatch.setattr(classify, 'detect', lambda img, *args: [{'box': (1, 2, 3, 4), 'class': 'x', 'probability': None}])
+
+    output = str(tmp_path / 'results.csv')
+    failed = batch_classify.batch_classify(str(images), output)
+
+    assert [f for (f, _) in failed] == [str(images / 'b.png')]
+    assert 'b.png' in capsys.readouterr().err
+    with open(output, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == batch_classify.COLUMNS
+    assert [row[0] for row in rows[1:]] == [str(images / 'a.png'), str(images / 'c.png')]
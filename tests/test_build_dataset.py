@@ -0,0 +1,51 @@
+import os
+
+import cv2
+import numpy as np
+
+import build_dataset
+import dataset
+import features
+
+def make_input(tmp_path, monkeypatch, images=3):
+    """Creates a small input directory, and makes build_dataset read it and write to tmp_path."""
+    directory = tmp_path / 'input' / 'general' / 'specific'
+    directory.mkdir(parents=True)
+    for i in range(images):
+        cv2.imwrite(str(directory / ('%d.jpg' % i)), np.full((8, 8), i, np.uint8))
+    monkeypatch.setattr(build_dataset, 'INPUT', str(tmp_path / 'input'))
+    monkeypatch.setattr(build_dataset, 'OUTPUT', str(tmp_path))
+    monkeypatch.setattr(build_dataset, 'CACHE', str(tmp_path / 'feature_cache'))
+    # One region per image, so the images need not contain anything
+    vector = [1.0] * len(features.get_labels())
+    monkeypatch.setattr(build_dataset, 'extract', lambda f: [(vector, [0, 0, 8, 8])])
+
+def test_no_csv(tmp_path, monkeypatch):
+    make_input(tmp_path, monkeypatch)
+    (tmp_path / 'dataset.csv').write_text('stale')
+    build_dataset.build_dataset(use_cache=False, csv=False)
+    assert not os.path.exists(str(tmp_path / 'dataset.csv'))
+    assert len(dataset.read_columnar(str(tmp_path / 'dataset'))) == 3
+
+def test_csv(tmp_path, monkeypatch):
+    make_input(tmp_path, monkeypatch)
+    build_dataset.build_dataset(use_cache=False, csv=True)
+    assert len(dataset.read(str(tmp_path / 'dataset.csv'))) == 3
+    assert len(dataset.read_columnar(str(tmp_path / 'dataset'))) == 3
+
+def test_interrupted_build_keeps_dataset(tmp_path, monkeypatch):
+    make_input(tmp_path, monkeypatch)
+    build_dataset.build_dataset(use_cache=False, csv=True)
+    previous = {name: (tmp_path / name).read_bytes() for name in ['dataset.csv', 'dataset.npy', 'dataset.labels.npy', 'dataset.json']}
+
+    def interrupted(f):
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(build_dataset, 'extract', interrupted)
+    try:
+        build_dataset.build_dataset(use_cache=False, csv=True)
+    except KeyboardInterrupt:
+        pass
+    else:
+        assert False, 'the build was not interrupted'
+    assert {name: (tmp_path / name).read_bytes() for name in previous} == previous
+    assert not [f for f in os.listdir(str(tmp_path)) if f.endswith('.part')]
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from conftest import ROOT
+
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import classify
+from model_registry import registry
+from pipeline import synthetic_image
+
+class FirstFeatureModel:
+    """Classifies a region by whether its first feature exceeds 50."""
+    def predict(self, X):
+        return np.where(X[:, 0] > 50, 'large', 'small')
+
+def test_detect_batch_of_no_images():
+    assert classify.detect_batch([]) == []
+
+def test_detect_batch_matches_detect(monkeypatch):
+    monkeypatch.setattr(registry, 'get', lambda classes, model: FirstFeatureModel())
+    imgs = [cv2.cvtColor(synthetic_image(seed, 600, 800, 4), cv2.COLOR_GRAY2BGR) for seed in range(2)]
+    batch = classify.detect_batch(imgs)
+    assert len(batch) == 2
+    for img, detections in zip(imgs, batch):
+        single = classify.detect(img)
+        assert [(d['box'], d['class']) for d in detections] == [(d['box'], d['class']) for d in single]
+
+def test_disabled_cache_skips_hashing(monkeypatch):
+    monkeypatch.setattr(registry, 'get', lambda classes, model: FirstFeatureModel())
+    monkeypatch.setattr(classify.cache, 'max_bytes', 0)
+    monkeypatch.setattr(classify.cache, 'directory', None)
+    def key(img, variant=''):
+        raise AssertionError('an image was hashed with the cache disabled')
+    monkeypatch.setattr(classify.cache, 'key', key)
+    img = cv2.cvtColor(synthetic_image(0, 600, 800, 4), cv2.COLOR_GRAY2BGR)
+    classify.detect(img)
+    classify.detect_batch([img])
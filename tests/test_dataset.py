@@ -0,0 +1,28 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset
+
+def frame(n):
+    return pd.DataFrame({'area': np.arange(n), 'ratio': np.linspace(0, 1, n), 'class': ['a', 'b'] * (n // 2)})
+
+def test_columnar_round_trip(tmp_path):
+    path = str(tmp_path / 'dataset')
+    df = frame(10)
+    dataset.write_columnar(df, path)
+    read = dataset.read_columnar(path)
+    assert read['area'].tolist() == df['area'].tolist()
+    assert np.allclose(read['ratio'], df['ratio'])
+    assert read['class'].tolist() == df['class'].tolist()
+
+def test_mixed_datasets_are_rejected(tmp_path):
+    # As if a build was killed after moving the metadata into place, but not the matrices
+    old, new = str(tmp_path / 'old'), str(tmp_path / 'new')
+    dataset.write_columnar(frame(10), old)
+    dataset.write_columnar(frame(6), new)
+    shutil.copy(old + '.npy', new + '.npy')
+    with pytest.raises(ValueError):
+        dataset.read_columnar(new)
@@ -0,0 +1,72 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import features
+import keypoints
+import preprocessor
+import subimages
+from pipeline import synthetic_image
+
+def reference_orb_features(full, orb_number=5):
+    """The ORB features of the full image the models were trained with, as originally computed."""
+    kp = cv2.ORB_create().detect(full, None)
+    size = len(kp)
+    if size < orb_number:
+        return False
+    distances = []
+    for i in range(size):
+        a = np.array(kp[i].pt)
+        for j in range(i + 1, size):
+            b = np.array(kp[j].pt)
+            distances.append(np.linalg.norm(a - b))
+    mean, std = np.mean(distances), np.std(distances)
+    distances.sort()
+    polygon_area = cv2.contourArea(cv2.convexHull(np.array([[k.pt] for k in kp], dtype='float32')))
+    return distances[:orb_number] + [mean, std, size, polygon_area]
+
+def reference_keypoint_count(cropped, cnt):
+    return sum([cv2.pointPolygonTest(cnt, k.pt, False) > -1 for k in cv2.ORB_create().detect(cropped, None)])
+
+def test_orb_features_match_the_trained_ones():
+    img = synthetic_image(1, 1200, 1600, 6)
+    context = keypoints.KeypointContext(img)
+    rois = subimages.extract(img, preprocessor.default_ensemble, context)
+    assert rois
+    expected = reference_orb_features(img)
+    for (cropped, cnt) in rois:
+        reference = expected + [reference_keypoint_count(cropped, cnt)]
+        assert features.orb_features(cropped, img, cnt, context=context) == reference
+    assert features.orb_features(cropped, img, cnt) == reference
+
+def loop_distances(points):
+    """The distances between every pair of points, as orb_features originally computed them."""
+    distances = []
+    for i in range(len(points)):
+        a = np.array(points[i])
+        for j in range(i + 1, len(points)):
+            b = np.array(points[j])
+            distances.append(np.linalg.norm(a - b))
+    return distances
+
+@pytest.mark.parametrize('n', [0, 1, 2, 5, 50, 500])
+def test_pairwise_distances_match_loop(n):
+    # ORB keypoint coordinates are float32 values
+    points = np.random.RandomState(n).uniform(0, 4000, (n, 2)).astype(np.float32).astype(np.float64)
+    distances, expected = features.pairwise_distances(points), loop_distances(points.tolist())
+    assert distances.tolist() == expected
+    if n > 1:
+        assert (np.mean(distances), np.std(distances)) == (np.mean(expected), np.std(expected))
+
+@pytest.mark.parametrize('n', [0, 3, 5, 10, 1000])
+def test_smallest_matches_sort(n):
+    values = np.random.RandomState(n).uniform(0, 100, n)
+    values[::3] = values[0] if n else 0 # with ties
+    assert features.smallest(values, 5).tolist() == sorted(values.tolist())[:5]
@@ -0,0 +1,30 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.append(os.path.join(ROOT, 'src', 'ui', 'web'))
+
+from jobs import JobQueue
+
+def test_failed_submit_releases_its_slot(tmp_path, monkeypatch):
+    queue = JobQueue(max_pending=1, directory=str(tmp_path))
+    def write(id, name, data):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(queue, '_write', write)
+    for _ in range(3):
+        with pytest.raises(OSError):
+            queue.submit(lambda directory: {})
+    assert queue.pending() == 0
+
+def test_default_directory_is_private():
+    queue = JobQueue()
+    root = queue.root()
+    try:
+        assert stat.S_IMODE(os.stat(root).st_mode) == 0o700
+        assert queue.root() == root
+    finally:
+        os.rmdir(root)
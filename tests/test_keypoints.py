@@ -0,0 +1,57 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import keypoints
+import preprocessor
+import subimages
+from pipeline import synthetic_image
+
+def context_of(points):
+    """A KeypointContext of the given keypoints, instead of detected ones."""
+    context = keypoints.KeypointContext.__new__(keypoints.KeypointContext)
+    context._set_points(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    return context
+
+def reference_in_contour(points, cnt):
+    """The keypoints inside a contour, as the models were trained with."""
+    return [tuple(p) for p in points if cv2.pointPolygonTest(cnt, tuple(p), False) > -1]
+
+def near_border(cnt, rng, n=200):
+    """Points on the vertices of a contour, and within two pixels of them."""
+    vertices = cnt.reshape(-1, 2).astype(np.float64)
+    points = vertices[rng.randint(len(vertices), size=n)]
+    return np.vstack([points[:n // 4], points[n // 4:] + rng.uniform(-2, 2, (n - n // 4, 2))])
+
+def check(cnt, points):
+    context = context_of(points)
+    assert sorted(map(tuple, context.in_contour(cnt).tolist())) == sorted(reference_in_contour(context.points.tolist(), cnt))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_in_contour_matches_point_polygon_test(seed):
+    rng = np.random.RandomState(seed)
+    img = synthetic_image(seed, 600, 800, 6)
+    contours = [c for c in subimages.find_contours(preprocessor.otsu(img)) if len(c) > 2]
+    assert contours
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        anywhere = np.c_[rng.uniform(x - 2, x + w + 2, 100), rng.uniform(y - 2, y + h + 2, 100)]
+        check(cnt, np.vstack([near_border(cnt, rng), anywhere]))
+
+def test_in_contour_of_thin_polygons():
+    # Random polygons have slivers and crossing edges, where the filled mask is wrong
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        cnt = rng.randint(0, 40, (rng.randint(3, 9), 1, 2)).astype(np.int32)
+        check(cnt, np.vstack([near_border(cnt, rng), rng.uniform(-1, 41, (200, 2))]))
+
+def test_in_contour_of_no_keypoints():
+    cnt = np.array([[[0, 0]], [[10, 0]], [[10, 10]]], np.int32)
+    assert len(context_of([]).in_contour(cnt)) == 0
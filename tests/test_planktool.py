@@ -0,0 +1,20 @@
+"""
+Smoke checks of the commands of planktool.py: every command must import its modules,
+from any working directory. `--help` is answered once they are imported.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+COMMANDS = ['build-dataset', 'build-models', 'build', 'evaluate', 'classify', 'serve']
+
+@pytest.mark.parametrize('command', COMMANDS)
+def test_command_imports(command, tmp_path):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'planktool.py'), command, '--help'], cwd=str(tmp_path),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith('Usage: planktool.py ' + command)
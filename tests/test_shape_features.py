@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+
+import shape_features
+
+def blob_image():
+    rng = np.random.RandomState(0)
+    img = rng.randint(0, 256, (300, 400)).astype(np.uint8)
+    cv2.ellipse(img, (200, 150), (90, 40), 30, 0, 360, 20, -1)
+    mask = np.zeros(img.shape, np.uint8)
+    cv2.ellipse(mask, (200, 150), (90, 40), 30, 0, 360, 255, -1)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return img, contours[0]
+
+@pytest.mark.parametrize('offset', [(0, 0), (150, 100), (1000, 800)])
+def test_window_features_match_whole_image(offset):
+    img, cnt = blob_image()
+    # The contour may lie partly or entirely outside of the image, e.g. when the image is a crop
+    cnt = cnt + np.array(offset, dtype=cnt.dtype)
+    rect, ellipse = cv2.minAreaRect(cnt), cv2.fitEllipse(cnt)
+    x1, y1, x2, y2 = shape_features.get_window(img, cnt, [rect, ellipse])
+    assert x1 < x2 and y1 < y2
+
+    window = img[y1:y2, x1:x2]
+    assert shape_features.get_rect_features(window, cnt, rect, (x1, y1)) == shape_features.get_rect_features(img, cnt, rect)
+    assert shape_features.get_el_mean(window, cnt, ellipse, (x1, y1)) == shape_features.get_el_mean(img, cnt, ellipse)
+
+def test_texture_features_describe_the_whole_image():
+    img, cnt = blob_image()
+    values = shape_features.get(img, cnt)
+    labels = shape_features.get_labels()
+    hu = [values[labels.index('hu%d' % i)] for i in range(7)]
+    expected = [-np.copysign(1.0, h) * np.log10(abs(h)) for h in cv2.HuMoments(cv2.moments(img)).flatten()]
+    assert hu == expected
+
+def loop_el_mask(height, width):
+    """The pixels outside of the ellipse, as get_el_mean originally tested them."""
+    centerx, centery = (width/2, height/2)
+    mask = np.zeros((height, width), bool)
+    for x in range(width):
+        for y in range(height):
+            mask[y, x] = float(x-centerx)**2/(centerx)**2 + float(y-centery)**2/(centery)**2 > 1
+    return mask
+
+@pytest.mark.parametrize('height, width', [(1, 1), (2, 3), (17, 40), (64, 64), (101, 37)])
+def test_el_mask_matches_loop(height, width):
+    mask = shape_features.get_el_mask(height, width)
+    assert mask.shape == (height, width)
+    assert (mask == loop_el_mask(height, width)).all()
+
+def test_el_mean_matches_loop():
+    img, cnt = blob_image()
+    ellipse = cv2.fitEllipse(cnt)
+    cropped = shape_features.crop_box(img, ellipse)
+    height, width = cropped.shape[:2]
+    outside = loop_el_mask(height, width)
+    cropped[outside] = 255 - cropped[outside]
+    assert shape_features.get_el_mean(img, cnt) == (np.mean(cropped), np.pi * height/2 * width/2)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import preprocessor
+import subimages
+from pipeline import synthetic_image
+
+def iou(a, b):
+    (ax, ay, aw, ah), (bx, by, bw, bh) = a, b
+    intersection = max(0, min(ax + aw, bx + bw) - max(ax, bx)) * max(0, min(ay + ah, by + bh) - max(ay, by))
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+def test_tiles_cover_the_image():
+    covered = np.zeros((1200, 1600), np.uint8)
+    for (x1, y1, x2, y2), (cx1, cy1, cx2, cy2) in subimages.get_tiles(covered.shape, 800, 256):
+        assert x1 <= cx1 and y1 <= cy1 and cx2 <= x2 and cy2 <= y2
+        assert x2 - x1 <= 800 and y2 - y1 <= 800
+        covered[cy1:cy2, cx1:cx2] += 1
+    assert (covered == 1).all()
+
+@pytest.mark.parametrize('seed, objects, tile_size', [(1, 6, 600), (1, 6, 800), (1, 6, 1000), (2, 10, 800), (2, 10, 1000)])
+def test_extract_tiled_matches_extract(seed, objects, tile_size):
+    img = synthetic_image(seed, 1200, 1600, objects)
+    assert len(subimages.get_tiles(img.shape, tile_size, 256)) > 1
+    full = [cv2.boundingRect(cnt) for (_, cnt) in subimages.extract(img, preprocessor.default_ensemble)]
+    rois, _ = subimages.extract_tiled(img, preprocessor.default_ensemble, tile_size, 256)
+    tiled = [cv2.boundingRect(cnt) for (_, cnt) in rois]
+
+    # Tiles are segmented on their own, so contours differ a little, but every object is found once
+    assert len(tiled) == len(full)
+    for box in full:
+        assert max(iou(box, other) for other in tiled) >= 0.5, box